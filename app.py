@@ -1,61 +1,340 @@
 import chainlit as cl
 from langchain_core.messages import HumanMessage, AIMessage
 from src.agent import RAGAgent
-from src.vector_store import VectorStore
 from ingest import DocumentIngestor
+from chat_manager import migrate_legacy_chats
 import os
-import time
 import json
+import re
+import asyncio
+import functools
+import heapq
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 
+try:
+    import orjson  # Optional: much faster JSON encode/decode
+except ImportError:
+    orjson = None
+
 DATA_DIR = "data"
 CHAT_HISTORY_DIR = "chat_history"
 
+# Stored message types and the LangChain classes they are restored as
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage}
+
+# Collapses runs of whitespace in chat titles
+_WS_RE = re.compile(r"\s+")
+
+# Progress bars for every 5% step, indexed by percentage // 5
+_BARS = tuple("🟩" * filled + "⬜" * (20 - filled) for filled in range(21))
+
+_INIT_PROGRESS_TEMPLATE = "🤖 **Initializing AI Assistant**\n\n{bar} **{percentage}%**\n\n{indicator} **{description}**"
+_INIT_INFO_TEMPLATE = "**Stage:** {stage}\n**Progress:** {percentage}%\n**Status:** {description}"
+_PDF_PROGRESS_TEMPLATE = "📄 **Processing: `{file_name}`**\n\n{bar} **{percentage}%**\n\n{indicator} **{step_name}**\n{description}"
+_PDF_INFO_TEMPLATE = "**Current Step:** {step_name}\n**Progress:** {percentage}%\n**File:** {file_name}\n**Status:** {description}"
+
+# Shared across uploads so the embedding model is only loaded once per process
+_INGESTOR: Optional[DocumentIngestor] = None
+
+# One agent per process; per-session state lives in cl.user_session
+_AGENT: Optional[RAGAgent] = None
+_AGENT_LOCK = asyncio.Lock()
+
+# Upper bound on concurrent agent runs, so bursts of users can't exhaust the worker thread pool
+MAX_CONCURRENT_LLM = int(os.getenv("MAX_CONCURRENT_LLM", "8"))
+_LLM_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_LLM)
+
 # Ensure chat history directory exists
 if not os.path.exists(CHAT_HISTORY_DIR):
     os.makedirs(CHAT_HISTORY_DIR)
 
-def generate_chat_title(first_message: str) -> str:
-    """Generate a chat title from the first user message."""
+# Per-chat files: a small metadata header and an append-only JSON Lines message log
+META_SUFFIX = ".meta.json"
+LOG_SUFFIX = ".jsonl"
+
+# Open append-mode file descriptors for chat logs, keyed by chat id
+_LOG_FDS: Dict[str, int] = {}
+
+# Append-only index of chat headers, so listing chats needs a single file read
+INDEX_FILE = "_index.jsonl"
+
+# In-memory chat index (chat id -> summary) and the directory it was loaded from
+_INDEX: Dict[str, Dict] = {}
+_INDEX_DIR: Optional[str] = None
+# Lines currently in the index file; it is compacted once superseded lines
+# outnumber live entries by this ratio (and there are more than a few of them)
+_INDEX_LINES = 0
+INDEX_COMPACT_RATIO = 2
+INDEX_COMPACT_MIN_LINES = 256
+_INDEX_LOCK = threading.RLock()
+
+# Chat headers waiting for the background flusher: chat id -> (title, message_count)
+FLUSH_INTERVAL = 0.25
+_DIRTY_META: Dict[str, tuple] = {}
+_FLUSH_EVENT: Optional[asyncio.Event] = None
+_FLUSH_TASK: Optional[asyncio.Task] = None
+_FLUSH_LOCK: Optional[asyncio.Lock] = None
+
+def _atomic_write(file_path: str, data: bytes):
+    """Write bytes to a temp file beside file_path, then atomically swap it in.
+    
+    Readers see either the old or the new contents, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _write_json(file_path: str, data: Dict, pretty: bool = False):
+    """Write data as JSON, using orjson when available.
+    
+    Output is compact by default; pass pretty=True for human-readable exports.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        payload = orjson.dumps(data, option=option)
+    elif pretty:
+        payload = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    else:
+        # Without indent the stdlib encoder stays on its C fast path
+        payload = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    _atomic_write(file_path, payload)
+
+def _read_json(file_path: str) -> Dict:
+    """Read a JSON file, using orjson when available."""
+    if orjson is not None:
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _dumps_line(data: Dict) -> bytes:
+    """Serialize a single record as one compact JSON line."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, separators=(',', ':'), ensure_ascii=False) + "\n").encode('utf-8')
+
+def _meta_path(chat_id: str) -> str:
+    """Path of the metadata header for a chat."""
+    return os.path.join(CHAT_HISTORY_DIR, f"{chat_id}{META_SUFFIX}")
+
+def _log_path(chat_id: str) -> str:
+    """Path of the message log for a chat."""
+    return os.path.join(CHAT_HISTORY_DIR, f"{chat_id}{LOG_SUFFIX}")
+
+def _close_chat_log(chat_id: str):
+    """Close the cached append descriptor for a chat log, if any."""
+    fd = _LOG_FDS.pop(chat_id, None)
+    if fd is not None:
+        os.close(fd)
+
+def _index_entry(chat_data: Dict, chat_id: str) -> Dict:
+    """Extract the summary fields kept in the chat index."""
+    return {
+        "id": chat_data.get("id", chat_id),
+        "title": chat_data.get("title", "Untitled Chat"),
+        "updated_at": chat_data.get("updated_at", ""),
+        "message_count": chat_data.get("message_count", 0)
+    }
+
+def _write_chat_index():
+    """Rewrite the index file with one line per chat."""
+    global _INDEX_LINES
+    _atomic_write(os.path.join(CHAT_HISTORY_DIR, INDEX_FILE),
+                  b"".join(_dumps_line(entry) for entry in _INDEX.values()))
+    _INDEX_LINES = len(_INDEX)
+
+def _rebuild_chat_index():
+    """Rebuild the chat index by reading every chat header."""
+    _INDEX.clear()
+    with os.scandir(CHAT_HISTORY_DIR) as it:
+        entries = [entry for entry in it if entry.name.endswith(META_SUFFIX)]
+    
+    # Header reads are small and I/O bound, so overlap them across threads
+    if entries:
+        with ThreadPoolExecutor(max_workers=min(32, len(entries))) as pool:
+            headers = list(pool.map(lambda entry: _read_json(entry.path), entries))
+        for entry, chat_data in zip(entries, headers):
+            chat_entry = _index_entry(chat_data, entry.name[:-len(META_SUFFIX)])
+            _INDEX[chat_entry["id"]] = chat_entry
+    _write_chat_index()
+
+def _ensure_chat_index():
+    """Load the chat index for the current history directory, rebuilding it if missing."""
+    global _INDEX_DIR, _INDEX_LINES
+    if _INDEX_DIR == CHAT_HISTORY_DIR:
+        return
+    _INDEX_DIR = CHAT_HISTORY_DIR
+    
+    index_path = os.path.join(CHAT_HISTORY_DIR, INDEX_FILE)
+    if not os.path.exists(index_path):
+        _rebuild_chat_index()
+        return
+    
+    # Later lines supersede earlier ones for the same chat
+    _INDEX.clear()
+    line_count = 0
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(index_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                chat_entry = loads(line)
+                _INDEX[chat_entry["id"]] = chat_entry
+                line_count += 1
+    
+    # Forget chats deleted outside the app (e.g. by chat_manager cleanup)
+    for chat_id in [chat_id for chat_id in _INDEX if not os.path.exists(_meta_path(chat_id))]:
+        del _INDEX[chat_id]
+    
+    _INDEX_LINES = line_count
+    if line_count > len(_INDEX):
+        _write_chat_index()
+
+def _update_chat_index(chat_entry: Dict):
+    """Upsert a chat into the index and append it to the index file.
+    
+    The file is compacted once superseded lines pile up, so it stays bounded
+    in a long-running process, not just across restarts.
+    """
+    global _INDEX_LINES
+    with _INDEX_LOCK:
+        _ensure_chat_index()
+        _INDEX[chat_entry["id"]] = chat_entry
+        if _INDEX_LINES + 1 > max(INDEX_COMPACT_RATIO * len(_INDEX), INDEX_COMPACT_MIN_LINES):
+            _write_chat_index()
+            return
+        with open(os.path.join(CHAT_HISTORY_DIR, INDEX_FILE), 'ab') as f:
+            f.write(_dumps_line(chat_entry))
+        _INDEX_LINES += 1
+
+@functools.lru_cache(maxsize=256)
+def _clean_title(first_message: str) -> str:
+    """Truncate a message to a title and collapse its whitespace."""
     # Take first 50 characters and clean up
     title = first_message.strip()[:50]
     if len(first_message) > 50:
         title += "..."
     
     # Remove newlines and extra spaces
-    title = " ".join(title.split())
+    return _WS_RE.sub(" ", title).strip()
+
+def generate_chat_title(first_message: str) -> str:
+    """Generate a chat title from the first user message."""
+    title = _clean_title(first_message)
     
-    # If empty or too short, use timestamp
-    if len(title.strip()) < 3:
+    # If empty or too short, use timestamp (not cached, it changes over time)
+    if len(title) < 3:
         title = f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"
     
     return title
 
-def save_chat_history(chat_id: str, messages: List[Dict], title: str):
-    """Save chat history to file."""
+def save_chat_meta(chat_id: str, title: str, message_count: int):
+    """Write the metadata header for a chat, keeping its original creation time."""
     try:
-        chat_data = {
+        meta_path = _meta_path(chat_id)
+        now = datetime.now().isoformat()
+        created_at = now
+        if os.path.exists(meta_path):
+            created_at = _read_json(meta_path).get("created_at", now)
+        
+        chat_meta = {
             "id": chat_id,
             "title": title,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-            "messages": messages
+            "created_at": created_at,
+            "updated_at": now,
+            "message_count": message_count
         }
-        
-        file_path = os.path.join(CHAT_HISTORY_DIR, f"{chat_id}.json")
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(chat_data, f, indent=2, ensure_ascii=False)
+        _write_json(meta_path, chat_meta)
+        _update_chat_index(_index_entry(chat_meta, chat_id))
+    except Exception as e:
+        print(f"Error saving chat metadata: {e}")
+
+def append_chat_message(chat_id: str, message: Dict):
+    """Append a single message to the chat's JSON Lines log."""
+    try:
+        fd = _LOG_FDS.get(chat_id)
+        if fd is None:
+            fd = os.open(_log_path(chat_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _LOG_FDS[chat_id] = fd
+        os.write(fd, _dumps_line(message))
+    except Exception as e:
+        print(f"Error appending chat message: {e}")
+
+def save_chat_history(chat_id: str, messages: List[Dict], title: str):
+    """Save the full chat history to file, replacing any existing log."""
+    try:
+        _close_chat_log(chat_id)
+        _atomic_write(_log_path(chat_id), b"".join(_dumps_line(message) for message in messages))
+        save_chat_meta(chat_id, title, len(messages))
     except Exception as e:
         print(f"Error saving chat history: {e}")
 
+def schedule_chat_meta(chat_id: str, title: str, message_count: int):
+    """Queue a chat header write; bursts are coalesced by a background flusher."""
+    global _FLUSH_EVENT, _FLUSH_TASK, _FLUSH_LOCK
+    _DIRTY_META[chat_id] = (title, message_count)
+    if _FLUSH_TASK is None or _FLUSH_TASK.done():
+        _FLUSH_EVENT = asyncio.Event()
+        _FLUSH_LOCK = asyncio.Lock()
+        _FLUSH_TASK = asyncio.create_task(_flush_loop())
+    _FLUSH_EVENT.set()
+
+async def _flush_loop():
+    """Write queued chat headers at most once per FLUSH_INTERVAL."""
+    while True:
+        await _FLUSH_EVENT.wait()
+        # Give further updates a chance to coalesce before writing
+        await asyncio.sleep(FLUSH_INTERVAL)
+        _FLUSH_EVENT.clear()
+        await flush_chat_meta()
+
+def _write_chat_metas(pending: Dict[str, tuple]):
+    """Write a batch of chat headers (runs in a worker thread)."""
+    for chat_id, (title, message_count) in pending.items():
+        save_chat_meta(chat_id, title, message_count)
+
+async def flush_chat_meta():
+    """Write all queued chat headers now, off the event loop."""
+    if not _DIRTY_META or _FLUSH_LOCK is None:
+        return
+    async with _FLUSH_LOCK:
+        pending = dict(_DIRTY_META)
+        _DIRTY_META.clear()
+        await asyncio.to_thread(_write_chat_metas, pending)
+
+def iter_chat_messages(chat_id: str):
+    """Stream the messages of a chat log one line at a time."""
+    log_path = _log_path(chat_id)
+    if not os.path.exists(log_path):
+        return
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(log_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
 def load_chat_history(chat_id: str) -> Optional[Dict]:
     """Load chat history from file."""
     try:
-        file_path = os.path.join(CHAT_HISTORY_DIR, f"{chat_id}.json")
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        meta_path = _meta_path(chat_id)
+        if os.path.exists(meta_path):
+            chat_data = _read_json(meta_path)
+            chat_data["messages"] = list(iter_chat_messages(chat_id))
+            return chat_data
     except Exception as e:
         print(f"Error loading chat history: {e}")
     return None
@@ -63,28 +342,85 @@ def load_chat_history(chat_id: str) -> Optional[Dict]:
 def get_recent_chats(limit: int = 10) -> List[Dict]:
     """Get list of recent chats."""
     try:
-        chat_files = []
-        for filename in os.listdir(CHAT_HISTORY_DIR):
-            if filename.endswith('.json'):
-                file_path = os.path.join(CHAT_HISTORY_DIR, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                    chat_files.append({
-                        "id": chat_data.get("id", filename[:-5]),
-                        "title": chat_data.get("title", "Untitled Chat"),
-                        "updated_at": chat_data.get("updated_at", ""),
-                        "message_count": len(chat_data.get("messages", []))
-                    })
+        with _INDEX_LOCK:
+            _ensure_chat_index()
+            chats = list(_INDEX.values())
         
-        # Sort by updated_at descending
-        chat_files.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
-        return chat_files[:limit]
+        # Most recently updated first; only the top `limit` entries are ordered
+        return heapq.nlargest(limit, chats, key=lambda x: x.get("updated_at", ""))
     
     except Exception as e:
         print(f"Error getting recent chats: {e}")
         return []
 
+# Upgrade any chats written in the old single-file format
+migrate_legacy_chats(on_migrated=lambda chat_meta: _update_chat_index(_index_entry(chat_meta, chat_meta["id"])))
+
+class ProgressBatcher:
+    """
+    Coalesces progress updates for a Chainlit message.
+    
+    submit() only records the latest update, so it is safe to call from
+    synchronous callbacks; a background task renders and sends it at most
+    once per interval, dropping any intermediate updates.
+    """
+    
+    def __init__(self, message: cl.Message, render, interval: float = 0.2):
+        """
+        Args:
+            message: The message that displays progress
+            render: Callable (stage, percentage, description) that updates the message content
+            interval: Minimum number of seconds between sends
+        """
+        self.message = message
+        self.render = render
+        self.interval = interval
+        self._latest = None
+        self._sent = None
+        self._task = None
+    
+    def submit(self, stage: str, percentage: int, description: str):
+        """Record the latest progress update."""
+        self._latest = (stage, percentage, description)
+    
+    def start(self):
+        """Start sending updates in the background."""
+        self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+    
+    async def flush(self):
+        """Send the latest update now if it hasn't been sent yet."""
+        latest = self._latest
+        if latest is None or latest is self._sent:
+            return
+        self._sent = latest
+        self.render(*latest)
+        await self.message.update()
+    
+    async def stop(self):
+        """Stop the background task and send any remaining update."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
 async def initialize_agent_with_progress() -> RAGAgent:
+    """Return the shared RAG agent, initializing it with progress tracking on first use."""
+    global _AGENT
+    async with _AGENT_LOCK:
+        if _AGENT is None:
+            _AGENT = await _create_agent_with_progress()
+    return _AGENT
+
+async def _create_agent_with_progress() -> RAGAgent:
     """Initialize the RAG agent with progress tracking."""
     progress_msg = cl.Message(
         content="🚀 Initializing AI Assistant...",
@@ -98,47 +434,32 @@ async def initialize_agent_with_progress() -> RAGAgent:
     )
     await progress_msg.send()
     
-    last_update_time = 0
-    
-    def init_progress(percentage: int, stage: str, description: str):
-        nonlocal last_update_time
-        current_time = time.time()
-        
-        # Rate limit updates
-        if current_time - last_update_time < 0.3 and percentage != 100:
-            return
-        
-        last_update_time = current_time
-        
-        # Create progress bar
-        filled = int(percentage // 5)
-        empty = 20 - filled
-        progress_bar = "🟩" * filled + "⬜" * empty
-        
-        step_indicator = "🔄" if percentage < 100 else "✅"
-        
-        # Store progress update to be sent later
-        progress_msg.content = f"""
-🤖 **Initializing AI Assistant**
-
-{progress_bar} **{percentage}%**
-
-{step_indicator} **{description}**
-        """.strip()
+    def render_init(stage: str, percentage: int, description: str):
+        bar = _BARS[min(20, int(percentage) // 5)]
+        indicator = "🔄" if percentage < 100 else "✅"
+        progress_msg.content = _INIT_PROGRESS_TEMPLATE.format(
+            bar=bar, percentage=percentage, indicator=indicator, description=description
+        )
         
         if progress_msg.elements:
-            progress_msg.elements[0].content = f"""
-**Stage:** {stage}
-**Progress:** {percentage}%
-**Status:** {description}
-            """.strip()
+            progress_msg.elements[0].content = _INIT_INFO_TEMPLATE.format(
+                stage=stage, percentage=percentage, description=description
+            )
+    
+    # Rate limit updates to one every 300ms
+    batcher = ProgressBatcher(progress_msg, render_init, interval=0.3)
+    batcher.start()
+    
+    def init_progress(percentage: int, stage: str, description: str):
+        batcher.submit(stage, percentage, description)
     
     try:
         # Initialize agent with progress tracking
-        agent = RAGAgent(progress_callback=init_progress)
+        # Build the agent in a worker thread so progress updates keep flowing
+        agent = await asyncio.to_thread(RAGAgent, progress_callback=init_progress)
         
         # Send final progress update
-        await progress_msg.update()
+        await batcher.stop()
         
         # Small delay to show completion
         await cl.sleep(0.5)
@@ -149,6 +470,7 @@ async def initialize_agent_with_progress() -> RAGAgent:
         return agent
         
     except Exception as e:
+        await batcher.stop()
         progress_msg.content = f"""
 ❌ **Initialization Failed**
 
@@ -184,6 +506,7 @@ async def on_chat_start():
     cl.user_session.set("chat_id", cl.user_session.get("id"))
     cl.user_session.set("chat_title", None)
     cl.user_session.set("message_history", [])
+    cl.user_session.set("agent_memory", [])
     cl.user_session.set("is_first_message", True)
     
     # Create welcome message with app title
@@ -251,20 +574,21 @@ async def on_chat_resume(thread: Any):
     if chat_data:
         cl.user_session.set("chat_id", thread.id)
         cl.user_session.set("chat_title", chat_data.get("title", "Resumed Chat"))
-        cl.user_session.set("message_history", chat_data.get("messages", []))
+        message_history = chat_data.get("messages", [])
+        cl.user_session.set("message_history", message_history)
+        cl.user_session.set("last_saved_len", len(message_history))
         cl.user_session.set("is_first_message", False)
         
         # Restore conversation context for the agent
-        messages = []
-        for msg in chat_data.get("messages", []):
-            if msg["type"] == "human":
-                messages.append(HumanMessage(content=msg["content"]))
-            elif msg["type"] == "ai":
-                messages.append(AIMessage(content=msg["content"]))
+        messages = [
+            _MESSAGE_TYPES[msg["type"]](content=msg["content"])
+            for msg in message_history
+            if msg["type"] in _MESSAGE_TYPES
+        ]
         
-        # Initialize agent with previous context
-        if messages:
-            agent._memory = messages
+        # Keep the previous context with the session, not on the shared agent;
+        # on_message sends it to the graph ahead of each new question
+        cl.user_session.set("agent_memory", RAGAgent.trim_history(messages))
         
         resume_header = """
 # 🤖 **Agentic RAG Assistant**
@@ -279,7 +603,7 @@ async def on_chat_resume(thread: Any):
 
 🔄 **Context restored** - Continue where you left off!
 
-📊 **Previous messages:** {len(chat_data.get('messages', []))} messages loaded
+📊 **Previous messages:** {len(message_history)} messages loaded
 """,
             author="🤖 Assistant"
         ).send()
@@ -288,24 +612,27 @@ async def on_chat_resume(thread: Any):
         await on_chat_start()
 
 
+def _copy_upload(source_path: str, target_path: str):
+    """Copy an uploaded file in fixed-size chunks, creating the data directory if needed."""
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        shutil.copyfileobj(source, target, length=1 << 20)
+
+
 async def process_pdf(file_path: str):
     """
     Processes a PDF file by saving it and ingesting it directly with progress bar.
     """
+    global _INGESTOR
     file_name = os.path.basename(file_path)
+    batcher = None
     
     try:
-        # Create data directory if it doesn't exist
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
-
         # Save the file to the data directory
         target_path = os.path.join(DATA_DIR, file_name)
         
-        # Copy the uploaded file to the data directory
-        with open(file_path, "rb") as source:
-            with open(target_path, "wb") as target:
-                target.write(source.read())
+        # Copy the uploaded file to the data directory in a worker thread
+        await asyncio.to_thread(_copy_upload, file_path, target_path)
 
         # Create progress message with initial state
         progress_msg = cl.Message(
@@ -320,20 +647,8 @@ async def process_pdf(file_path: str):
         )
         await progress_msg.send()
 
-        # Define progress callback with detailed progress bar and rate limiting
-        last_update_time = 0
-        pending_updates = []
-        
-        async def update_progress(step_name: str, percentage: int, description: str):
-            nonlocal last_update_time
-            current_time = time.time()
-            
-            # Rate limit updates to prevent payload overflow (max 1 update per 200ms)
-            if current_time - last_update_time < 0.2 and percentage != 100 and percentage != -1:
-                return
-            
-            last_update_time = current_time
-            
+        # Render progress into the message; the batcher decides when to send it
+        def render_progress(step_name: str, percentage: int, description: str):
             if percentage == -1:  # Error case
                 progress_msg.content = f"""
 ❌ **Processing Failed**
@@ -342,49 +657,42 @@ async def process_pdf(file_path: str):
 
 Please check the file and try again.
                 """.strip()
-                await progress_msg.update()
                 return
             
-            # Create animated progress bar
-            filled = int(percentage // 5)  # 20 segments for 100%
-            empty = 20 - filled
-            progress_bar = "🟩" * filled + "⬜" * empty
-            
-            # Add step indicator
-            step_indicator = "🔄" if percentage < 100 else "✅"
-            
-            progress_msg.content = f"""
-📄 **Processing: `{file_name}`**
-
-{progress_bar} **{percentage}%**
-
-{step_indicator} **{step_name}**
-{description}
-            """.strip()
+            bar = _BARS[min(20, int(percentage) // 5)]  # 20 segments for 100%
+            indicator = "🔄" if percentage < 100 else "✅"
+            progress_msg.content = _PDF_PROGRESS_TEMPLATE.format(
+                file_name=file_name, bar=bar, percentage=percentage,
+                indicator=indicator, step_name=step_name, description=description
+            )
             
             # Update the side info as well
             if progress_msg.elements:
-                progress_msg.elements[0].content = f"""
-**Current Step:** {step_name}
-**Progress:** {percentage}%
-**File:** {file_name}
-**Status:** {description}
-                """.strip()
-            
-            await progress_msg.update()
-
-        # Create synchronous progress wrapper for DocumentIngestor
-        def sync_progress_wrapper(percentage: int, stage: str, description: str):
-            # Store the update to be processed later
-            pending_updates.append((stage, percentage, description))
+                progress_msg.elements[0].content = _PDF_INFO_TEMPLATE.format(
+                    step_name=step_name, percentage=percentage, file_name=file_name, description=description
+                )
 
-        # Initialize ingestor and process the file
-        ingestor = DocumentIngestor(progress_callback=sync_progress_wrapper)
+        # Send at most one update per 200ms to prevent payload overflow
+        batcher = ProgressBatcher(progress_msg, render_progress, interval=0.2)
+        batcher.start()
         
-        # Process any pending updates from initialization
-        for stage, percentage, description in pending_updates:
-            await update_progress(stage, percentage, description)
-        pending_updates.clear()
+        async def update_progress(step_name: str, percentage: int, description: str):
+            batcher.submit(step_name, percentage, description)
+            # Completion and errors are shown immediately
+            if percentage == 100 or percentage == -1:
+                await batcher.flush()
+
+        # Synchronous progress callback for DocumentIngestor initialization
+        def ingestor_progress(percentage: int, stage: str, description: str):
+            batcher.submit(stage, percentage, description)
+
+        # Reuse one ingestor per process. Its constructor callback only reports the
+        # one-time model load; per-upload progress goes through ingest_pdf's callback,
+        # so concurrent uploads never share (or overwrite) a callback
+        if _INGESTOR is None:
+            _INGESTOR = DocumentIngestor(progress_callback=ingestor_progress)
+            _INGESTOR.progress_callback = None
+        ingestor = _INGESTOR
         
         success = await ingestor.ingest_pdf(target_path, update_progress)
         
@@ -392,19 +700,8 @@ Please check the file and try again.
             # Update the vector store in the agent (refresh it)
             agent = cl.user_session.get("agent")
             if agent:
-                # Create a simple progress callback for vector store refresh
-                def refresh_progress(percentage: int, stage: str, description: str):
-                    if percentage == 100:
-                        # We can't await here, so we'll just update the progress synchronously
-                        # This will be processed in the next update cycle
-                        pending_updates.append(("vector_refresh", 95, "🔄 Refreshing knowledge base..."))
-                
-                agent.vector_store = VectorStore(progress_callback=refresh_progress)
-                
-                # Process any pending updates from vector store refresh
-                for stage, percentage, description in pending_updates:
-                    await update_progress(stage, percentage, description)
-                pending_updates.clear()
+                await update_progress("vector_refresh", 95, "🔄 Refreshing knowledge base...")
+                agent.vector_store.refresh()
             
             # Final success message
             final_msg = cl.Message(
@@ -431,6 +728,21 @@ Failed to process `{file_name}`: {str(e)}
 Please check the file format and try again.
             """.strip()
         ).send()
+    
+    finally:
+        if batcher:
+            await batcher.stop()
+
+
+async def _set_response(msg: cl.Message, content: str, message_history: List[Dict], timestamp: str):
+    """Show the final response (or error) and record it in the message history."""
+    msg.content = content
+    await msg.update()
+    message_history.append({
+        "type": "ai",
+        "content": content,
+        "timestamp": timestamp
+    })
 
 
 @cl.on_message
@@ -454,6 +766,7 @@ async def on_message(message: cl.Message):
     chat_id = cl.user_session.get("chat_id")
     chat_title = cl.user_session.get("chat_title")
     message_history = cl.user_session.get("message_history", [])
+    agent_memory = cl.user_session.get("agent_memory", [])
     is_first_message = cl.user_session.get("is_first_message", True)
 
     # Generate chat title from first message
@@ -462,84 +775,80 @@ async def on_message(message: cl.Message):
         cl.user_session.set("chat_title", chat_title)
         cl.user_session.set("is_first_message", False)
 
+    # One timestamp for the whole turn, shared by the user and AI records
+    now_iso = datetime.now().isoformat()
+    
     # Add user message to history
     user_message = {
         "type": "human",
         "content": message.content,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": now_iso
     }
     message_history.append(user_message)
+    if chat_id and chat_title:
+        append_chat_message(chat_id, user_message)
 
     # Create a streaming message
     msg = cl.Message(content="🤔 Thinking...")
     await msg.send()
 
     try:
-        # Use invoke instead of astream to avoid payload issues
-        result = agent.graph.invoke({"messages": [HumanMessage(content=message.content)]})
+        # Stream the answer token by token as the generate node produces it.
+        # Graph nodes are synchronous and run in worker threads; the semaphore
+        # bounds how many runs are in flight at once.
+        result = {}
+        streamed = False
+        human_message = HumanMessage(content=message.content)
+        graph_input = {"messages": RAGAgent.trim_history(agent_memory + [human_message]), "context": ""}
+        async with _LLM_SEMAPHORE:
+            async for event in agent.graph.astream_events(graph_input, version="v2"):
+                if event["event"] == "on_chat_model_stream":
+                    # Only stream the answer, not the rewritten query
+                    if event["metadata"].get("langgraph_node") != "generate":
+                        continue
+                    token = event["data"]["chunk"].content
+                    if token:
+                        if not streamed:
+                            # Replace the thinking placeholder with the first token
+                            msg.content = ""
+                            streamed = True
+                        await msg.stream_token(token)
+                elif event["event"] == "on_chain_end" and not event["parent_ids"]:
+                    # The graph's final state
+                    result = event["data"]["output"]
         
         if "messages" in result and len(result["messages"]) > 0:
             # Get the last AI message (response)
             last_message = result["messages"][-1]
             if hasattr(last_message, 'content') and last_message.content:
-                # Update with the final response
-                ai_response = last_message.content
-                msg.content = ai_response
-                await msg.update()
-                
-                # Add AI response to history
-                ai_message = {
-                    "type": "ai",
-                    "content": ai_response,
-                    "timestamp": datetime.now().isoformat()
-                }
-                message_history.append(ai_message)
-                
+                await _set_response(msg, last_message.content, message_history, now_iso)
+                # Only the user's question and the answer carry over, not rewritten queries
+                agent_memory.extend((human_message, AIMessage(content=last_message.content)))
+                cl.user_session.set("agent_memory", RAGAgent.trim_history(agent_memory))
             else:
-                error_response = "I apologize, but I couldn't generate a response. Please try again."
-                msg.content = error_response
-                await msg.update()
-                
-                # Add error response to history
-                ai_message = {
-                    "type": "ai",
-                    "content": error_response,
-                    "timestamp": datetime.now().isoformat()
-                }
-                message_history.append(ai_message)
+                await _set_response(
+                    msg, "I apologize, but I couldn't generate a response. Please try again.",
+                    message_history, now_iso
+                )
         else:
-            error_response = "No response generated. Please try rephrasing your question."
-            msg.content = error_response
-            await msg.update()
-            
-            # Add error response to history
-            ai_message = {
-                "type": "ai",
-                "content": error_response,
-                "timestamp": datetime.now().isoformat()
-            }
-            message_history.append(ai_message)
+            await _set_response(
+                msg, "No response generated. Please try rephrasing your question.",
+                message_history, now_iso
+            )
                     
     except Exception as e:
-        error_msg = f"Error processing your request: {str(e)}"
-        msg.content = error_msg
-        await msg.update()
-        
-        # Add error to history
-        ai_message = {
-            "type": "ai",
-            "content": error_msg,
-            "timestamp": datetime.now().isoformat()
-        }
-        message_history.append(ai_message)
+        await _set_response(msg, f"Error processing your request: {str(e)}", message_history, now_iso)
     
     finally:
         # Update session with new message history
         cl.user_session.set("message_history", message_history)
         
-        # Save chat history to file
+        # Append the response to the chat log and refresh its metadata
         if chat_id and chat_title:
-            save_chat_history(chat_id, message_history, chat_title)
+            if message_history[-1] is not user_message:
+                append_chat_message(chat_id, message_history[-1])
+            schedule_chat_meta(chat_id, chat_title, len(message_history))
+            cl.user_session.set("last_saved_len", len(message_history))
 
 @cl.on_settings_update
 async def setup_agent(settings):
@@ -557,10 +866,29 @@ async def on_stop():
     chat_title = cl.user_session.get("chat_title")
     message_history = cl.user_session.get("message_history", [])
     
+    # Write out any chat headers still waiting for the background flusher
+    await flush_chat_meta()
+    
+    # Nothing to do if every message is already in the chat log
+    if cl.user_session.get("last_saved_len", 0) == len(message_history):
+        return
+    
     if chat_id and chat_title and message_history:
         save_chat_history(chat_id, message_history, chat_title)
+        cl.user_session.set("last_saved_len", len(message_history))
         print(f"Chat history saved for: {chat_title}")
 
+@cl.on_chat_end
+async def on_chat_end():
+    """
+    Flush pending chat headers and release the chat log file handle when the session ends.
+    """
+    await flush_chat_meta()
+    
+    chat_id = cl.user_session.get("chat_id")
+    if chat_id:
+        _close_chat_log(chat_id)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -7,103 +7,471 @@ exporting, and cleaning up old conversations.
 """
 
 import os
+import re
+import sys
 import json
 import argparse
+import gzip
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import csv
 
+try:
+    import orjson  # Optional: much faster JSON encode/decode
+except ImportError:
+    orjson = None
+
 CHAT_HISTORY_DIR = "chat_history"
 
+logger = logging.getLogger("chat_manager")
+
+# Chats are stored as a metadata header plus a JSON Lines message log
+META_SUFFIX = ".meta.json"
+LOG_SUFFIX = ".jsonl"
+
+# Sidecar SQLite cache of chat headers, refreshed by the mtime/size of each header and its log
+INDEX_DB = ".index.sqlite"
+INDEX_VERSION = 3
+
+# Characters not allowed in export file names (word characters, spaces and hyphens are kept)
+_UNSAFE_TITLE_RE = re.compile(r"[^\w \-]")
+
+# Per-query fallback search caches kept in CHAT_HISTORY_DIR; least recently used ones are evicted
+SEARCH_CACHE_PREFIX = ".search_cache."
+SEARCH_CACHE_MAX_FILES = 64
+
+# datetime.fromisoformat accepts a trailing "Z" from Python 3.11 on
+_FROMISO_HANDLES_Z = sys.version_info >= (3, 11)
+
 def ensure_chat_dir():
     """Ensure chat history directory exists."""
     if not os.path.exists(CHAT_HISTORY_DIR):
         os.makedirs(CHAT_HISTORY_DIR)
         print(f"Created chat history directory: {CHAT_HISTORY_DIR}")
 
+def _read_json(file_path: str) -> Dict:
+    """Read a JSON file, using orjson when available."""
+    if orjson is not None:
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _atomic_write(file_path: str, data: bytes):
+    """Write bytes to a temp file beside file_path, then atomically swap it in.
+    
+    Readers see either the old or the new contents, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _dumps_line(data: Dict) -> bytes:
+    """Serialize a single record as one compact JSON line."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, separators=(',', ':'), ensure_ascii=False) + "\n").encode('utf-8')
+
+def _chat_id_from_filename(filename: str) -> str:
+    """Derive a chat id from a metadata or legacy chat file name."""
+    if filename.endswith(META_SUFFIX):
+        return filename[:-len(META_SUFFIX)]
+    return filename[:-5]
+
+def _chat_file_path(chat_id: str) -> Optional[str]:
+    """Find the metadata (or legacy) file for a chat id."""
+    for suffix in (META_SUFFIX, ".json"):
+        file_path = os.path.join(CHAT_HISTORY_DIR, f"{chat_id}{suffix}")
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+def load_chat_meta(file_path: str) -> Dict:
+    """Load a chat's header fields without its messages."""
+    chat_data = _read_json(file_path)
+    
+    if not file_path.endswith(META_SUFFIX):
+        # Legacy files embed their messages; keep only the count
+        chat_data["message_count"] = len(chat_data.pop("messages", []))
+    
+    return chat_data
+
+def iter_chat_messages(file_path: str):
+    """Yield a chat's messages one at a time from its log (or legacy file)."""
+    if not file_path.endswith(META_SUFFIX):
+        yield from _read_json(file_path).get("messages", [])
+        return
+    
+    try:
+        f = open(file_path[:-len(META_SUFFIX)] + LOG_SUFFIX, 'rb')
+    except FileNotFoundError:
+        return  # No messages logged yet
+    loads = orjson.loads if orjson is not None else json.loads
+    with f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+def _updated_timestamp(updated_str: str) -> Optional[float]:
+    """Convert an ISO updated_at string to a local timestamp, or None if unparseable."""
+    if not _FROMISO_HANDLES_Z and updated_str.endswith('Z'):
+        updated_str = updated_str[:-1] + '+00:00'
+    try:
+        updated_date = datetime.fromisoformat(updated_str)
+    except ValueError:
+        return None
+    return updated_date.replace(tzinfo=None).timestamp()  # Remove timezone for comparison
+
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    """Whether the index has a full-text table (SQLite may be built without FTS5)."""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_fts'").fetchone() is not None
+
+def _index_messages(conn: sqlite3.Connection, filename: str, messages: List[Dict]):
+    """Replace a chat's rows in the full-text table with its current messages."""
+    conn.execute("DELETE FROM chat_fts WHERE filename = ?", (filename,))
+    conn.executemany(
+        "INSERT INTO chat_fts (filename, position, role, content) VALUES (?, ?, ?, ?)",
+        ((filename, i + 1, message.get("type", ""), message.get("content", ""))
+         for i, message in enumerate(messages)))
+
+def _load_for_index(file_path: str, with_messages: bool) -> tuple:
+    """Read what the index needs from one chat file (runs in a worker thread).
+    
+    Returns (chat_data, messages, error); messages is None unless requested.
+    """
+    try:
+        chat_data = load_chat_meta(file_path)
+        messages = list(iter_chat_messages(file_path)) if with_messages else None
+        return chat_data, messages, None
+    except (OSError, ValueError) as e:
+        return None, None, e
+
+def _refresh_index(conn: sqlite3.Connection):
+    """Re-read the headers of chats whose files changed since they were indexed.
+    
+    A chat's key covers its message log as well as its header: messages are appended
+    to the log before the header is rewritten, and the header may never be rewritten
+    if the app stops in between.
+    """
+    cached = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT filename, mtime_ns, size, log_mtime_ns, log_size FROM chats")}
+    seen = set()
+    changed = []
+    headers = []
+    log_stats = {}
+    fts = _has_fts(conn)
+    
+    with os.scandir(CHAT_HISTORY_DIR) as it:
+        for entry in it:
+            # d_type from the directory read answers is_file without a stat call
+            if not entry.name.endswith(('.json', LOG_SUFFIX)) or not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.name.endswith(LOG_SUFFIX):
+                log_stats[entry.name[:-len(LOG_SUFFIX)]] = entry.stat()
+            else:
+                headers.append(entry)
+    
+    for entry in headers:
+        seen.add(entry.name)
+        stat = entry.stat()
+        # Legacy files hold their own messages, so they have no separate log
+        log_stat = log_stats.get(_chat_id_from_filename(entry.name)) if entry.name.endswith(META_SUFFIX) else None
+        key = (stat.st_mtime_ns, stat.st_size,
+               log_stat.st_mtime_ns if log_stat else None, log_stat.st_size if log_stat else None)
+        if cached.get(entry.name) != key:
+            changed.append((entry, key))
+    
+    # Reads are independent and I/O bound, so overlap them across threads;
+    # SQLite writes stay on this thread
+    if changed:
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4, len(changed))) as pool:
+            loaded = list(pool.map(lambda item: _load_for_index(item[0].path, fts), changed))
+    else:
+        loaded = []
+    
+    for (entry, key), (chat_data, messages, error) in zip(changed, loaded):
+        if error is not None:
+            logger.warning("Error reading %s: %s", entry.name, error)
+            continue
+        if fts:
+            _index_messages(conn, entry.name, messages)
+        
+        updated_at = chat_data.get("updated_at", "")
+        conn.execute(
+            "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry.name, *key,
+             chat_data.get("id", _chat_id_from_filename(entry.name)),
+             chat_data.get("title", "Untitled Chat"),
+             chat_data.get("created_at", ""),
+             updated_at,
+             _updated_timestamp(updated_at) if updated_at else None,
+             chat_data.get("message_count", 0)))
+    
+    # Drop chats whose files were removed
+    removed = [(name,) for name in cached.keys() - seen]
+    conn.executemany("DELETE FROM chats WHERE filename = ?", removed)
+    if fts:
+        conn.executemany("DELETE FROM chat_fts WHERE filename = ?", removed)
+    conn.commit()
+
+def _open_index() -> sqlite3.Connection:
+    """Open the chat header index, bringing it up to date with the directory."""
+    conn = sqlite3.connect(os.path.join(CHAT_HISTORY_DIR, INDEX_DB))
+    conn.row_factory = sqlite3.Row
+    
+    if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        conn.execute("DROP TABLE IF EXISTS chats")
+        conn.execute("DROP TABLE IF EXISTS chat_fts")
+        conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chats (
+            filename TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            size INTEGER,
+            log_mtime_ns INTEGER,
+            log_size INTEGER,
+            id TEXT,
+            title TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            updated_ts REAL,
+            message_count INTEGER
+        )
+    """)
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+                filename UNINDEXED,
+                position UNINDEXED,
+                role UNINDEXED,
+                content,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError:
+        pass  # No FTS5 in this SQLite build; search falls back to scanning
+    
+    _refresh_index(conn)
+    return conn
+
+def load_chat(file_path: str) -> Dict:
+    """Load a chat, including its messages, from its metadata or legacy file."""
+    chat_data = _read_json(file_path)
+    
+    if file_path.endswith(META_SUFFIX):
+        chat_data["messages"] = list(iter_chat_messages(file_path))
+    
+    return chat_data
+
 def list_chats(limit: Optional[int] = None, show_details: bool = False) -> List[Dict]:
     """List all available chats."""
     ensure_chat_dir()
     
+    # Sorted by updated_at descending; a LIMIT of -1 means no limit
+    with closing(_open_index()) as conn:
+        rows = conn.execute(
+            "SELECT filename, id, title, created_at, updated_at, message_count "
+            "FROM chats ORDER BY updated_at DESC LIMIT ?", (limit or -1,)).fetchall()
+    
     chats = []
-    for filename in os.listdir(CHAT_HISTORY_DIR):
-        if filename.endswith('.json'):
+    for row in rows:
+        file_path = os.path.join(CHAT_HISTORY_DIR, row["filename"])
+        chat_info = {
+            "id": row["id"],
+            "title": row["title"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "message_count": row["message_count"],
+            "file_path": file_path
+        }
+        
+        if show_details:
             try:
-                file_path = os.path.join(CHAT_HISTORY_DIR, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                    
-                chat_info = {
-                    "id": chat_data.get("id", filename[:-5]),
-                    "title": chat_data.get("title", "Untitled Chat"),
-                    "created_at": chat_data.get("created_at", ""),
-                    "updated_at": chat_data.get("updated_at", ""),
-                    "message_count": len(chat_data.get("messages", [])),
-                    "file_path": file_path
-                }
-                
-                if show_details:
-                    messages = chat_data.get("messages", [])
-                    if messages:
-                        chat_info["first_message"] = messages[0].get("content", "")[:100] + "..."
-                        chat_info["last_message"] = messages[-1].get("content", "")[:100] + "..."
-                
-                chats.append(chat_info)
-                
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"Error reading {filename}: {e}")
+                # Stream the log, keeping only the first and last message
+                first = last = None
+                for message in iter_chat_messages(file_path):
+                    if first is None:
+                        first = message
+                    last = message
+                if first is not None:
+                    chat_info["first_message"] = first.get("content", "")[:100] + "..."
+                    chat_info["last_message"] = last.get("content", "")[:100] + "..."
+            except (OSError, ValueError) as e:
+                logger.warning("Error reading %s: %s", row['filename'], e)
+        
+        chats.append(chat_info)
     
-    # Sort by updated_at descending
-    chats.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
+    return chats
+
+def _fts_matches(conn: sqlite3.Connection, query: str) -> Dict[str, tuple]:
+    """Find the best-ranked matching message of each chat as (position, snippet)."""
+    # Quote the query as a phrase so user input is never parsed as FTS syntax,
+    # and treat its last token as a prefix to stay close to substring matching
+    phrase = '"' + query.replace('"', '""') + '"*'
+    matches = {}
+    for filename, position, snippet in conn.execute(
+            "SELECT filename, position, snippet(chat_fts, 3, '[', ']', '...', 16) "
+            "FROM chat_fts WHERE chat_fts MATCH ? ORDER BY bm25(chat_fts)", (phrase,)):
+        matches.setdefault(filename, (position, snippet))
+    return matches
+
+def _raw_needle(query_lower: str) -> Optional[bytes]:
+    """Encode a query for prefiltering raw chat files, or None if that could miss matches.
     
-    if limit:
-        chats = chats[:limit]
+    Only plain ASCII text is safe: bytes.lower() folds ASCII letters only, and
+    quotes, backslashes and control characters are escaped inside JSON strings.
+    """
+    if query_lower.isascii() and query_lower.isprintable() and '"' not in query_lower and '\\' not in query_lower:
+        return query_lower.encode('ascii')
+    return None
+
+def _messages_file(file_path: str) -> str:
+    """Path of the file holding a chat's messages (its log, or the legacy file itself)."""
+    if file_path.endswith(META_SUFFIX):
+        return file_path[:-len(META_SUFFIX)] + LOG_SUFFIX
+    return file_path
+
+def _scan_messages(file_path: str, query_lower: str, needle: Optional[bytes]) -> Optional[list]:
+    """Find the first message containing the query as [position, content preview]."""
+    # Skip parsing chats whose raw bytes cannot contain the query
+    if needle is not None:
+        try:
+            with open(_messages_file(file_path), 'rb') as f:
+                if needle not in f.read().lower():
+                    return None
+        except FileNotFoundError:
+            return None
     
-    return chats
+    for i, message in enumerate(iter_chat_messages(file_path)):
+        content = message.get("content", "")
+        if query_lower in content.lower():
+            return [i + 1, content[:200] + "..."]
+    return None
+
+def _search_cache_path(query_lower: str) -> str:
+    """Path of the on-disk scan results for one query."""
+    key = hashlib.blake2b(query_lower.encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(CHAT_HISTORY_DIR, f"{SEARCH_CACHE_PREFIX}{key}")
 
-def search_chats(query: str, limit: Optional[int] = None) -> List[Dict]:
-    """Search chats by content or title."""
+def _evict_search_caches():
+    """Delete all but the SEARCH_CACHE_MAX_FILES most recently used search caches."""
+    with os.scandir(CHAT_HISTORY_DIR) as it:
+        caches = [(entry.stat().st_mtime_ns, entry.path) for entry in it
+                  if entry.name.startswith(SEARCH_CACHE_PREFIX)]
+    if len(caches) <= SEARCH_CACHE_MAX_FILES:
+        return
+    caches.sort(reverse=True)
+    for _, path in caches[SEARCH_CACHE_MAX_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def search_chats(query: str, limit: Optional[int] = None, fallback: bool = False) -> List[Dict]:
+    """Search chats by content or title.
+    
+    Message content is searched through the full-text index; pass fallback=True
+    (or use a SQLite build without FTS5) to scan message logs for substrings instead.
+    """
     ensure_chat_dir()
     
     matching_chats = []
     query_lower = query.lower()
+    needle = _raw_needle(query_lower)
     
-    for filename in os.listdir(CHAT_HISTORY_DIR):
-        if filename.endswith('.json'):
-            try:
-                file_path = os.path.join(CHAT_HISTORY_DIR, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                
-                # Check title
-                title = chat_data.get("title", "").lower()
-                if query_lower in title:
-                    matching_chats.append({
-                        "id": chat_data.get("id", filename[:-5]),
-                        "title": chat_data.get("title", "Untitled Chat"),
-                        "updated_at": chat_data.get("updated_at", ""),
-                        "match_type": "title",
-                        "file_path": file_path
-                    })
-                    continue
-                
-                # Check message content
-                messages = chat_data.get("messages", [])
-                for i, message in enumerate(messages):
-                    content = message.get("content", "").lower()
-                    if query_lower in content:
-                        matching_chats.append({
-                            "id": chat_data.get("id", filename[:-5]),
-                            "title": chat_data.get("title", "Untitled Chat"),
-                            "updated_at": chat_data.get("updated_at", ""),
-                            "match_type": f"message_{i+1}",
-                            "match_content": message.get("content", "")[:200] + "...",
-                            "file_path": file_path
-                        })
-                        break  # Only include each chat once
-                        
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"Error searching {filename}: {e}")
+    with closing(_open_index()) as conn:
+        rows = conn.execute(
+            "SELECT filename, mtime_ns, log_mtime_ns, log_size, id, title, updated_at FROM chats").fetchall()
+        content_matches = None
+        if not fallback and query.strip() and _has_fts(conn):
+            content_matches = _fts_matches(conn, query)
+    
+    # Scan results per file for this query, reused while the header and log are unchanged
+    scan_cache = {}
+    new_scan_cache = {}
+    if content_matches is None:
+        cache_path = _search_cache_path(query_lower)
+        try:
+            scan_cache = _read_json(cache_path)
+        except (OSError, ValueError):
+            pass
+    
+    for row in rows:
+        filename = row["filename"]
+        file_path = os.path.join(CHAT_HISTORY_DIR, filename)
+        
+        # Check title
+        if query_lower in row["title"].lower():
+            matching_chats.append({
+                "id": row["id"],
+                "title": row["title"],
+                "updated_at": row["updated_at"],
+                "match_type": "title",
+                "file_path": file_path
+            })
+            continue
+        
+        if content_matches is not None:
+            match = content_matches.get(filename)
+            if match:
+                matching_chats.append({
+                    "id": row["id"],
+                    "title": row["title"],
+                    "updated_at": row["updated_at"],
+                    "match_type": f"message_{match[0]}",
+                    "match_content": match[1],
+                    "file_path": file_path
+                })
+            continue
+        
+        try:
+            cached = scan_cache.get(filename)
+            file_key = [row["mtime_ns"], row["log_mtime_ns"], row["log_size"]]
+            if cached is not None and cached[0] == file_key:
+                match = cached[1]
+            else:
+                # Check message content, stopping at the first match
+                match = _scan_messages(file_path, query_lower, needle)
+            new_scan_cache[filename] = [file_key, match]
+            
+            if match:
+                matching_chats.append({
+                    "id": row["id"],
+                    "title": row["title"],
+                    "updated_at": row["updated_at"],
+                    "match_type": f"message_{match[0]}",
+                    "match_content": match[1],
+                    "file_path": file_path
+                })
+                    
+        except (OSError, ValueError) as e:
+            logger.warning("Error searching %s: %s", filename, e)
+    
+    # Rewrite the cache with current files only, so deleted chats expire;
+    # an unchanged cache is touched instead, to mark it recently used
+    if content_matches is None:
+        try:
+            if new_scan_cache != scan_cache:
+                _atomic_write(cache_path, _dumps_line(new_scan_cache))
+                _evict_search_caches()
+            elif scan_cache:
+                os.utime(cache_path)
+        except OSError as e:
+            logger.warning("Error writing search cache: %s", e)
     
     # Sort by updated_at descending
     matching_chats.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
@@ -113,101 +481,131 @@ def search_chats(query: str, limit: Optional[int] = None) -> List[Dict]:
     
     return matching_chats
 
-def export_chat(chat_id: str, format: str = "json") -> bool:
-    """Export a specific chat to different formats."""
+def export_chat(chat_id: str, format: str = "json", compress: bool = False) -> bool:
+    """Export a specific chat to different formats.
+    
+    With compress=True a JSON export is written as gzipped JSON Lines: a header
+    line followed by one line per message.
+    """
     ensure_chat_dir()
     
-    file_path = os.path.join(CHAT_HISTORY_DIR, f"{chat_id}.json")
-    if not os.path.exists(file_path):
+    file_path = _chat_file_path(chat_id)
+    if not file_path:
         print(f"Chat not found: {chat_id}")
         return False
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chat_data = json.load(f)
+        # Messages are streamed from the log by the text exports
+        chat_data = load_chat_meta(file_path)
         
         title = chat_data.get("title", "Untitled Chat")
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        safe_title = _UNSAFE_TITLE_RE.sub("", title).rstrip()
         
         if format.lower() == "txt":
             # Export as text
             export_path = f"{safe_title}.txt"
+            parts = [
+                "Chat Title: ", title, "\n",
+                "Created: ", chat_data.get('created_at', 'Unknown'), "\n",
+                "Updated: ", chat_data.get('updated_at', 'Unknown'), "\n",
+                "=" * 50, "\n\n",
+            ]
+            separator = "\n\n" + "-" * 30 + "\n\n"
+            for message in iter_chat_messages(file_path):
+                msg_type = "👤 User" if message.get("type") == "human" else "🤖 Assistant"
+                parts.extend((msg_type, " (", message.get("timestamp", ""), "):\n",
+                              message.get("content", ""), separator))
+            
+            # One buffered write pass instead of two writes per message
             with open(export_path, 'w', encoding='utf-8') as f:
-                f.write(f"Chat Title: {title}\n")
-                f.write(f"Created: {chat_data.get('created_at', 'Unknown')}\n")
-                f.write(f"Updated: {chat_data.get('updated_at', 'Unknown')}\n")
-                f.write("=" * 50 + "\n\n")
-                
-                for message in chat_data.get("messages", []):
-                    msg_type = "👤 User" if message.get("type") == "human" else "🤖 Assistant"
-                    timestamp = message.get("timestamp", "")
-                    content = message.get("content", "")
-                    
-                    f.write(f"{msg_type} ({timestamp}):\n{content}\n\n")
-                    f.write("-" * 30 + "\n\n")
+                f.writelines(parts)
             
             print(f"Exported to: {export_path}")
             
         elif format.lower() == "csv":
             # Export as CSV
             export_path = f"{safe_title}.csv"
-            with open(export_path, 'w', newline='', encoding='utf-8') as f:
+            with open(export_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
                 writer = csv.writer(f)
                 writer.writerow(["Type", "Content", "Timestamp"])
-                
-                for message in chat_data.get("messages", []):
-                    writer.writerow([
-                        message.get("type", ""),
-                        message.get("content", ""),
-                        message.get("timestamp", "")
-                    ])
+                writer.writerows(
+                    (message.get("type", ""), message.get("content", ""), message.get("timestamp", ""))
+                    for message in iter_chat_messages(file_path))
+            
+            print(f"Exported to: {export_path}")
+            
+        elif compress:
+            # Export as gzipped JSON Lines, streaming messages from the log
+            export_path = f"{safe_title}.jsonl.gz"
+            with gzip.open(export_path, 'wb', compresslevel=1) as gz:
+                gz.write(_dumps_line(chat_data))
+                gz.writelines(_dumps_line(message) for message in iter_chat_messages(file_path))
             
             print(f"Exported to: {export_path}")
             
         else:
             # Export as JSON (default)
             export_path = f"{safe_title}.json"
-            with open(export_path, 'w', encoding='utf-8') as f:
-                json.dump(chat_data, f, indent=2, ensure_ascii=False)
+            chat_data = load_chat(file_path)
+            if orjson is not None:
+                with open(export_path, 'wb') as f:
+                    f.write(orjson.dumps(chat_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            else:
+                with open(export_path, 'w', encoding='utf-8') as f:
+                    json.dump(chat_data, f, indent=2, ensure_ascii=False)
             
             print(f"Exported to: {export_path}")
         
         return True
         
-    except Exception as e:
-        print(f"Error exporting chat: {e}")
+    except (OSError, ValueError) as e:
+        logger.error("Error exporting chat: %s", e)
         return False
 
 def cleanup_old_chats(days: int = 30, dry_run: bool = True) -> int:
     """Clean up chats older than specified days."""
     ensure_chat_dir()
     
-    cutoff_date = datetime.now() - timedelta(days=days)
+    cutoff_ts = (datetime.now() - timedelta(days=days)).timestamp()
     deleted_count = 0
+    deleted = []
+    errors = []
     
-    for filename in os.listdir(CHAT_HISTORY_DIR):
-        if filename.endswith('.json'):
+    # The index refresh only re-reads files whose mtime changed, so old chats
+    # are selected here without opening any chat files
+    with closing(_open_index()) as conn:
+        rows = conn.execute(
+            "SELECT filename, title, updated_at FROM chats WHERE updated_ts < ?", (cutoff_ts,)).fetchall()
+        
+        for row in rows:
+            filename = row["filename"]
+            if dry_run:
+                print(f"Would delete: {row['title']} (updated: {row['updated_at']})")
+                deleted_count += 1
+                continue
+            
             try:
-                file_path = os.path.join(CHAT_HISTORY_DIR, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)
-                
-                updated_str = chat_data.get("updated_at", "")
-                if updated_str:
-                    updated_date = datetime.fromisoformat(updated_str.replace('Z', '+00:00'))
-                    updated_date = updated_date.replace(tzinfo=None)  # Remove timezone for comparison
-                    
-                    if updated_date < cutoff_date:
-                        title = chat_data.get("title", "Untitled Chat")
-                        if dry_run:
-                            print(f"Would delete: {title} (updated: {updated_str})")
-                        else:
-                            os.remove(file_path)
-                            print(f"Deleted: {title}")
-                        deleted_count += 1
-                        
-            except Exception as e:
-                print(f"Error processing {filename}: {e}")
+                os.unlink(os.path.join(CHAT_HISTORY_DIR, filename))
+                try:
+                    os.unlink(os.path.join(CHAT_HISTORY_DIR, _chat_id_from_filename(filename) + LOG_SUFFIX))
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                errors.append(f"{filename}: {e}")
+                continue
+            deleted.append((filename,))
+            print(f"Deleted: {row['title']}")
+            deleted_count += 1
+        
+        # Drop all deleted chats from the index in one batch
+        if deleted:
+            conn.executemany("DELETE FROM chats WHERE filename = ?", deleted)
+            if _has_fts(conn):
+                conn.executemany("DELETE FROM chat_fts WHERE filename = ?", deleted)
+            conn.commit()
+    
+    if errors:
+        logger.warning("Failed to delete %d chat(s):\n  %s", len(errors), "\n  ".join(errors))
     
     if dry_run and deleted_count > 0:
         print(f"\nDry run: {deleted_count} chat(s) would be deleted.")
@@ -217,9 +615,51 @@ def cleanup_old_chats(days: int = 30, dry_run: bool = True) -> int:
     
     return deleted_count
 
+def migrate_legacy_chats(on_migrated: Optional[Callable[[Dict], None]] = None) -> int:
+    """Convert single-file JSON chats to a metadata header plus JSON Lines log.
+    
+    Both new files are written atomically and the legacy file is removed last, so an
+    interrupted migration leaves the source in place and can simply be re-run.
+    on_migrated, if given, is called with each new chat header (the app uses it to
+    update its chat index).
+    """
+    ensure_chat_dir()
+    
+    with os.scandir(CHAT_HISTORY_DIR) as it:
+        legacy_files = [entry for entry in it
+                        if entry.name.endswith('.json') and not entry.name.endswith(META_SUFFIX)]
+    
+    migrated_count = 0
+    for entry in legacy_files:
+        try:
+            chat_data = _read_json(entry.path)
+            chat_id = chat_data.get("id", _chat_id_from_filename(entry.name))
+            messages = chat_data.get("messages", [])
+            
+            # Write the log before the header, so a header always has a complete log
+            _atomic_write(os.path.join(CHAT_HISTORY_DIR, chat_id + LOG_SUFFIX),
+                          b"".join(_dumps_line(message) for message in messages))
+            chat_meta = {
+                "id": chat_id,
+                "title": chat_data.get("title", "Untitled Chat"),
+                "created_at": chat_data.get("created_at", ""),
+                "updated_at": chat_data.get("updated_at", ""),
+                "message_count": len(messages)
+            }
+            _atomic_write(os.path.join(CHAT_HISTORY_DIR, chat_id + META_SUFFIX), _dumps_line(chat_meta))
+            if on_migrated is not None:
+                on_migrated(chat_meta)
+            os.unlink(entry.path)
+            migrated_count += 1
+        except (OSError, ValueError) as e:
+            logger.warning("Error migrating %s: %s", entry.name, e)
+    
+    return migrated_count
+
 def main():
     """Main CLI interface."""
     parser = argparse.ArgumentParser(description="Manage chat history for RAG application")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report errors, not per-file warnings")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
     
     # List command
@@ -231,18 +671,24 @@ def main():
     search_parser = subparsers.add_parser("search", help="Search chats")
     search_parser.add_argument("query", help="Search query")
     search_parser.add_argument("--limit", type=int, help="Limit number of results")
+    search_parser.add_argument("--fallback", action="store_true", help="Scan message logs instead of using the full-text index")
     
     # Export command
     export_parser = subparsers.add_parser("export", help="Export a chat")
     export_parser.add_argument("chat_id", help="Chat ID to export")
     export_parser.add_argument("--format", choices=["json", "txt", "csv"], default="json", help="Export format")
+    export_parser.add_argument("--gzip", action="store_true", help="Write a JSON export as gzipped JSON Lines")
     
     # Cleanup command
     cleanup_parser = subparsers.add_parser("cleanup", help="Clean up old chats")
     cleanup_parser.add_argument("--days", type=int, default=30, help="Delete chats older than this many days")
     cleanup_parser.add_argument("--confirm", action="store_true", help="Actually delete (not dry run)")
     
+    # Migrate command
+    subparsers.add_parser("migrate", help="Convert single-file JSON chats to the JSON Lines format")
+    
     args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR if args.quiet else logging.INFO, format="%(message)s")
     
     if args.command == "list":
         chats = list_chats(args.limit, args.details)
@@ -263,7 +709,7 @@ def main():
                 print("-" * 40)
     
     elif args.command == "search":
-        results = search_chats(args.query, args.limit)
+        results = search_chats(args.query, args.limit, args.fallback)
         if not results:
             print(f"No chats found matching: {args.query}")
         else:
@@ -278,13 +724,17 @@ def main():
                 print("-" * 40)
     
     elif args.command == "export":
-        success = export_chat(args.chat_id, args.format)
+        success = export_chat(args.chat_id, args.format, args.gzip)
         if not success:
             exit(1)
     
     elif args.command == "cleanup":
         deleted = cleanup_old_chats(args.days, not args.confirm)
     
+    elif args.command == "migrate":
+        migrated = migrate_legacy_chats()
+        print(f"Migrated {migrated} chat(s).")
+    
     else:
         parser.print_help()
 
@@ -3,21 +3,91 @@ Script to clear ChromaDB collection when switching embedding models.
 Use this when you change embedding models and get dimension mismatch errors.
 """
 
-import chromadb
+import functools
+import gc
 import os
-import shutil
-from pathlib import Path
+import subprocess
+import sys
+import tempfile
 
 # Constants (same as in ingest.py)
 CHROMA_DB_PATH = "chroma_db"
 CHROMA_COLLECTION_NAME = "rag_collection"
 
+@functools.lru_cache(maxsize=1)
+def _client():
+    """Shared PersistentClient, so the database is opened once per run."""
+    # Imported lazily: chromadb is slow to import and unneeded when no DB exists
+    import chromadb
+    return chromadb.PersistentClient(path=CHROMA_DB_PATH)
+
+def _release_client():
+    """Close the shared client, if one was opened, so its database files are released.
+    
+    Dropping the cached reference alone leaves the client's sqlite handles open until
+    garbage collection, and Windows refuses to rename a directory with open files.
+    """
+    if _client.cache_info().currsize == 0:
+        return
+    client = _client()
+    _client.cache_clear()
+    if hasattr(client, "close"):
+        client.close()
+    else:
+        # Older chromadb releases have no close(); drop the process-wide system cache instead
+        client.clear_system_cache()
+    del client
+    gc.collect()
+
+# Deletes the directory tree given as its argument
+_REMOVER_SCRIPT = "import shutil, sys; shutil.rmtree(sys.argv[1], ignore_errors=True)"
+
+def _delete_detached(path: str) -> subprocess.Popen:
+    """Delete a directory tree in a detached child process, so the caller can exit at once."""
+    if os.name == "nt":
+        detach = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {"start_new_session": True}
+    return subprocess.Popen(
+        [sys.executable, "-c", _REMOVER_SCRIPT, path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        close_fds=True, **detach,
+    )
+
+def _trash_prefix(path: str) -> tuple:
+    """Parent directory and name prefix of the trash directories for path."""
+    path = os.path.abspath(path)
+    return os.path.dirname(path), f"{os.path.basename(path)}.trash."
+
+def sweep_trash(path: str):
+    """Start deleting trash directories that earlier runs could not finish removing."""
+    parent, prefix = _trash_prefix(path)
+    with os.scandir(parent) as it:
+        leftovers = [entry.path for entry in it if entry.name.startswith(prefix) and entry.is_dir()]
+    for leftover in leftovers:
+        _delete_detached(leftover)
+
+def discard_directory(path: str) -> subprocess.Popen:
+    """Move a directory out of the way at once and delete it in the background.
+    
+    The rename is atomic, so the path is free for re-ingestion immediately; the
+    slow per-file unlinks happen in a detached process, so the CLI returns at once.
+    Each call gets its own uniquely named trash directory.
+    """
+    parent, prefix = _trash_prefix(path)
+    trash_path = tempfile.mkdtemp(prefix=prefix, dir=parent)
+    os.rename(path, os.path.join(trash_path, os.path.basename(os.path.abspath(path))))
+    return _delete_detached(trash_path)
+
 def clear_chroma_collection():
     """Clear the existing ChromaDB collection to allow new embedding dimensions."""
     
     print("🧹 ChromaDB Collection Reset Tool")
     print("=" * 50)
     
+    # Finish removing databases discarded by earlier runs
+    sweep_trash(CHROMA_DB_PATH)
+    
     if not os.path.exists(CHROMA_DB_PATH):
         print(f"✅ No existing ChromaDB found at {CHROMA_DB_PATH}")
         print("   You can proceed with ingestion directly.")
@@ -40,16 +110,17 @@ def clear_chroma_collection():
         # Method 1: Try to delete the collection via ChromaDB API
         print("\n🔄 Attempting to delete collection via ChromaDB API...")
         try:
-            client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-            client.delete_collection(name=CHROMA_COLLECTION_NAME)
+            _client().delete_collection(name=CHROMA_COLLECTION_NAME)
             print(f"✅ Successfully deleted collection '{CHROMA_COLLECTION_NAME}'")
         except Exception as e:
             print(f"⚠️  API deletion failed: {e}")
             print("   Falling back to directory removal...")
             
             # Method 2: Remove the entire ChromaDB directory
+            # Close the cached client first so its file handles are released
+            _release_client()
             if os.path.exists(CHROMA_DB_PATH):
-                shutil.rmtree(CHROMA_DB_PATH)
+                discard_directory(CHROMA_DB_PATH)
                 print(f"✅ Successfully removed ChromaDB directory: {CHROMA_DB_PATH}")
         
         print("\n🎉 ChromaDB collection cleared successfully!")
@@ -76,8 +147,7 @@ def show_collection_info():
         return
     
     try:
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        collections = client.list_collections()
+        collections = _client().list_collections()
         
         print("📊 ChromaDB Information:")
         print(f"   Path: {CHROMA_DB_PATH}")
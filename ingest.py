@@ -5,10 +5,18 @@ from langchain_community.document_loaders import PyPDFLoader
 from langchain_huggingface import HuggingFaceEmbeddings
 import chromadb
 from tqdm import tqdm
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 import chainlit as cl
 import time
 import asyncio
+import contextlib
+import hashlib
+import itertools
+import multiprocessing
+import pickle
+import tempfile
+import numpy as np
+from src.vector_store import open_collection
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +25,8 @@ load_dotenv()
 DATA_DIR = "data"
 CHROMA_DB_PATH = "chroma_db"
 CHROMA_COLLECTION_NAME = "rag_collection"
+# Parsed and split PDFs, keyed by SHA-256 of the file contents
+PARSE_CACHE_DIR = ".pdf_cache"
 
 # Hugging Face model configuration
 DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # Fast and lightweight
@@ -25,6 +35,206 @@ DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"  # Fast and l
 # "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # Multilingual support
 # "BAAI/bge-small-en-v1.5"  # High performance
 
+# Text splitting configuration
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Max content hashes per Chroma lookup when reusing stored embeddings
+HASH_LOOKUP_BATCH = 500
+# Records per collection.add call (also capped by the client's max batch size)
+ADD_BATCH_SIZE = 1000
+# Chunks buffered per embed/store round when streaming a single PDF
+STREAM_BATCH_SIZE = 128
+# Chunks embedded per round in bulk ingestion, while remaining files are still being parsed
+BULK_EMBED_BATCH = 1000
+
+
+# Text splitter used for all ingested documents; it holds no per-document state,
+# so one instance per process is shared by every PDF and thread
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    is_separator_regex=False,
+)
+
+
+# Processing steps with their progress percentages and descriptions
+PROCESSING_STEPS = (
+    ("Loading PDF document", 10, "📖 Reading the PDF file and extracting content..."),
+    ("Splitting into chunks", 25, "✂️ Breaking document into manageable pieces..."),
+    ("Processing chunks", 45, "📝 Analyzing and preparing text chunks..."),
+    ("Generating embeddings", 75, "🧠 Creating AI embeddings for semantic search..."),
+    ("Storing in database", 90, "💾 Saving to vector database..."),
+    ("Finalizing", 100, "✅ Process completed successfully!"),
+)
+PROGRESS_BAR_WIDTH = 30
+
+
+def _progress_bar(percentage: int, width: int) -> str:
+    """Render a terminal progress bar, e.g. "[███░░░] 50%"."""
+    filled = int(percentage * width // 100)
+    return f"[{'█' * filled}{'░' * (width - filled)}] {percentage}%"
+
+
+# Terminal progress bars for each step, built once
+_PROGRESS_BARS = {percentage: _progress_bar(percentage, PROGRESS_BAR_WIDTH) for _, percentage, _ in PROCESSING_STEPS}
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _open_parse_cache(digest: str) -> Optional[Iterator[Tuple[list, list]]]:
+    """Return an iterator over the cached (texts, metadatas) batches for a PDF digest, if present."""
+    try:
+        f = open(os.path.join(PARSE_CACHE_DIR, f"{digest}.pkl"), "rb")
+    except OSError:
+        return None
+    return _iter_cache_batches(f)
+
+
+def _iter_cache_batches(f) -> Iterator[Tuple[list, list]]:
+    """Unpickle batches from an open parse cache file until it is exhausted, then close it."""
+    with f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _read_parse_cache(digest: str) -> Optional[Tuple[list, list]]:
+    """Return cached (chunk texts, chunk metadatas) for a PDF digest, if present."""
+    batches = _open_parse_cache(digest)
+    if batches is None:
+        return None
+    texts, metadatas = [], []
+    try:
+        for batch_texts, batch_metadatas in batches:
+            texts.extend(batch_texts)
+            metadatas.extend(batch_metadatas)
+    except (OSError, pickle.UnpicklingError):
+        return None
+    return texts, metadatas
+
+
+class _ParseCacheWriter:
+    """
+    Writes split chunks for one PDF to the parse cache a batch at a time.
+    
+    Batches are appended to a temp file that replaces the cache entry only in
+    commit(), so readers never see a partial entry. Write failures disable the
+    writer; they only cost a re-parse later.
+    """
+    
+    def __init__(self, digest: str):
+        self.path = os.path.join(PARSE_CACHE_DIR, f"{digest}.pkl")
+        self._file = None
+        try:
+            os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+            fd, self._tmp_path = tempfile.mkstemp(dir=PARSE_CACHE_DIR, suffix=".tmp")
+            self._file = os.fdopen(fd, "wb")
+        except OSError as e:
+            print(f"⚠️ Could not cache parsed PDF: {e}")
+    
+    def append(self, texts: list, metadatas: list):
+        """Pickle one batch. Pickling copies the metadata, so later changes to it are not cached."""
+        if self._file is None:
+            return
+        try:
+            pickle.dump((texts, metadatas), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"⚠️ Could not cache parsed PDF: {e}")
+            self.discard()
+    
+    def commit(self):
+        """Publish the batches written so far as the cache entry."""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not cache parsed PDF: {e}")
+            self.discard()
+    
+    def discard(self):
+        """Drop the temp file without touching any existing cache entry."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with contextlib.suppress(OSError):
+            os.remove(self._tmp_path)
+
+
+def _write_parse_cache(digest: str, texts: list, metadatas: list):
+    """Store split chunks for a PDF digest; failures only cost a re-parse later."""
+    writer = _ParseCacheWriter(digest)
+    writer.append(texts, metadatas)
+    writer.commit()
+
+
+def _chunk_ids(pdf_path: str, digest: str, count: int, start: int = 0) -> list[str]:
+    """Chunk IDs derived from file contents, so re-adding an unchanged file is a no-op."""
+    filename = os.path.basename(pdf_path)
+    return [f"{filename}-{digest[:16]}-{i}" for i in range(start, start + count)]
+
+
+def _iter_chunks(pdf_path: str) -> Iterator[Tuple[str, dict]]:
+    """Yield (text, metadata) chunks page by page, without loading the whole PDF."""
+    for page in PyPDFLoader(pdf_path).lazy_load():
+        for chunk in TEXT_SPLITTER.split_documents([page]):
+            yield chunk.page_content, chunk.metadata
+
+
+def _next_batch(chunks: Iterator[Tuple[str, dict]], size: int) -> Tuple[list, list]:
+    """Take up to `size` chunks from an iterator as (texts, metadatas)."""
+    batch = list(itertools.islice(chunks, size))
+    return [text for text, _ in batch], [metadata for _, metadata in batch]
+
+
+def load_and_split(pdf_path: str) -> Tuple[list, list, list]:
+    """
+    Load a PDF and split it into chunks. Pure function, so it can run in a worker process.
+    
+    Files parsed before are served from the parse cache.
+    
+    Args:
+        pdf_path: Path to the PDF file
+        
+    Returns:
+        Tuple of (chunk ids, chunk texts, chunk metadatas)
+    """
+    digest = file_digest(pdf_path)
+    cached = _read_parse_cache(digest)
+    if cached is None:
+        documents = PyPDFLoader(pdf_path).load()
+        chunks = TEXT_SPLITTER.split_documents(documents)
+        cached = ([chunk.page_content for chunk in chunks], [chunk.metadata for chunk in chunks])
+        _write_parse_cache(digest, *cached)
+    texts, metadatas = cached
+    return _chunk_ids(pdf_path, digest, len(texts)), texts, metadatas
+
+
+def content_hash(text: str) -> str:
+    """Stable hash of a chunk's text, stored in chunk metadata to find duplicate chunks."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _load_and_split_safe(pdf_path: str) -> Tuple[Optional[Tuple[list, list, list]], Optional[str]]:
+    """Run load_and_split, returning (result, error message) so one bad file doesn't abort a pool."""
+    try:
+        return load_and_split(pdf_path), None
+    except Exception as e:
+        return None, str(e)
+
 
 class DocumentIngestor:
     """
@@ -78,7 +288,7 @@ class DocumentIngestor:
         try:
             # Initialize ChromaDB first to check existing dimensions
             self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-            self.collection = self.client.get_or_create_collection(name=CHROMA_COLLECTION_NAME)
+            self.collection = open_collection(self.client)
             
             # Check existing dimensions
             existing_dims = self._detect_existing_dimensions()
@@ -117,8 +327,7 @@ class DocumentIngestor:
             if hasattr(self, 'progress_callback') and self.progress_callback:
                 self.progress_callback(65, "model_verify", "🔍 Verifying model compatibility...")
             
-            test_embedding = self.embeddings.embed_query("test")
-            new_dims = len(test_embedding)
+            new_dims = self._embedding_dimensions()
             
             if existing_dims and existing_dims != new_dims:
                 error_msg = f"""
@@ -145,22 +354,86 @@ class DocumentIngestor:
         except Exception as e:
             raise Exception(f"Error initializing components: {e}")
     
-    def _get_processing_steps(self) -> list[Tuple[str, int, str]]:
+    def _embedding_dimensions(self) -> int:
+        """Output dimensions of the embedding model, read from its config when possible."""
+        # HuggingFaceEmbeddings wraps a SentenceTransformer (`_client` in newer releases)
+        model = getattr(self.embeddings, "_client", None) or getattr(self.embeddings, "client", None)
+        get_dimension = getattr(model, "get_sentence_embedding_dimension", None)
+        dims = get_dimension() if get_dimension else None
+        if dims:
+            return dims
+        # Fall back to embedding a probe string
+        return len(self.embeddings.embed_query("test"))
+    
+    def _embed_chunks(self, texts: list[str], metadatas: list[dict]) -> np.ndarray:
+        """
+        Embed chunk texts, skipping chunks whose content was already embedded.
+        
+        Identical chunks (repeated boilerplate, headers, re-ingested pages) reuse the
+        embedding already stored in the collection or computed earlier in the batch.
+        Each chunk's metadata gets a ``content_hash`` so later ingests can find it.
+        
+        Returns a float32 array, which Chroma sends as compact base64 instead of JSON floats.
+        """
+        hashes = [content_hash(text) for text in texts]
+        for metadata, text_hash in zip(metadatas, hashes):
+            metadata["content_hash"] = text_hash
+        
+        known = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), HASH_LOOKUP_BATCH):
+            try:
+                stored = self.collection.get(
+                    where={"content_hash": {"$in": unique_hashes[start:start + HASH_LOOKUP_BATCH]}},
+                    include=["embeddings", "metadatas"],
+                )
+            except Exception:
+                continue  # Lookup is only an optimization
+            for metadata, embedding in zip(stored["metadatas"], stored["embeddings"]):
+                known[metadata["content_hash"]] = np.asarray(embedding, dtype=np.float32)
+        
+        # Embed the first occurrence of each unseen chunk
+        pending = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in known and text_hash not in pending:
+                pending[text_hash] = text
+        if pending:
+            # SentenceTransformer.encode already sorts inputs by length before
+            # batching (smart batching), so padding is minimal without reordering here
+            # Converted straight away so the Python float lists are freed right after encoding
+            fresh = np.asarray(self.embeddings.embed_documents(list(pending.values())), dtype=np.float32)
+            known.update(zip(pending, fresh))
+        
+        if len(pending) < len(texts):
+            print(f"♻️ Reused embeddings for {len(texts) - len(pending)} duplicate chunk(s)")
+        return np.asarray([known[text_hash] for text_hash in hashes], dtype=np.float32)
+    
+    def _add_chunks(self, ids: list, embeddings: np.ndarray, documents: list, metadatas: list):
+        """Store chunks in the collection using a few large add calls."""
+        batch_size = ADD_BATCH_SIZE
+        try:
+            batch_size = min(batch_size, self.client.get_max_batch_size())
+        except Exception:
+            pass
+        
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            self.collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+            )
+    
+    def _get_processing_steps(self) -> tuple[Tuple[str, int, str], ...]:
         """Get the processing steps with their progress percentages and descriptions."""
-        return [
-            ("Loading PDF document", 10, "📖 Reading the PDF file and extracting content..."),
-            ("Splitting into chunks", 25, "✂️ Breaking document into manageable pieces..."),
-            ("Processing chunks", 45, "📝 Analyzing and preparing text chunks..."),
-            ("Generating embeddings", 75, "🧠 Creating AI embeddings for semantic search..."),
-            ("Storing in database", 90, "💾 Saving to vector database..."),
-            ("Finalizing", 100, "✅ Process completed successfully!")
-        ]
+        return PROCESSING_STEPS
     
-    def _create_progress_visual(self, percentage: int, width: int = 30) -> str:
+    def _create_progress_visual(self, percentage: int, width: int = PROGRESS_BAR_WIDTH) -> str:
         """Create a visual progress bar for terminal output."""
-        filled = int(percentage * width // 100)
-        empty = width - filled
-        return f"[{'█' * filled}{'░' * empty}] {percentage}%"
+        if width == PROGRESS_BAR_WIDTH and percentage in _PROGRESS_BARS:
+            return _PROGRESS_BARS[percentage]
+        return _progress_bar(percentage, width)
     
     async def ingest_pdf(self, pdf_path: str, progress_callback: Optional[callable] = None) -> bool:
         """
@@ -175,81 +448,92 @@ class DocumentIngestor:
         """
         steps = self._get_processing_steps()
         start_time = time.time()
+        cache_writer = None
+        
+        async def report(step: int, description: Optional[str] = None):
+            if progress_callback:
+                step_name, percentage, default_description = steps[step]
+                await progress_callback(step_name, percentage, description or default_description)
         
         try:
-            for i, (step_name, percentage, description) in enumerate(steps):
-                if progress_callback:
-                    await progress_callback(step_name, percentage, description)
+            # Blocking stages run in worker threads so the event loop stays responsive
+            await report(0)
+            digest = await asyncio.to_thread(file_digest, pdf_path)
+            cached = await asyncio.to_thread(_open_parse_cache, digest)
+            
+            # Pages are parsed (or read from the parse cache), split, embedded and stored
+            # a batch at a time, so only one batch of chunks is in memory
+            await report(1)
+            if cached is not None:
+                chunks = itertools.chain.from_iterable(zip(*batch) for batch in cached)
+                cache_writer = None
+            else:
+                chunks = _iter_chunks(pdf_path)
+                cache_writer = await asyncio.to_thread(_ParseCacheWriter, digest)
+            total = 0
+            while True:
+                chunk_texts, chunk_metadatas = await asyncio.to_thread(_next_batch, chunks, STREAM_BATCH_SIZE)
+                if not chunk_texts:
+                    break
+                if cache_writer is not None:
+                    # Before _embed_chunks adds content_hash to the metadata
+                    await asyncio.to_thread(cache_writer.append, chunk_texts, chunk_metadatas)
                 
-                # Add small delay only for visual feedback, but reduce it to prevent payload issues
-                if i < len(steps) - 1:
-                    await asyncio.sleep(0.1)  # Reduced from 0.2 to 0.1
+                if total == 0:
+                    await report(2)
+                    # Generating embeddings is usually the slowest step
+                    await report(3)
+                print(f"🧠 Generating embeddings for {len(chunk_texts)} chunks...")
+                chunk_embeddings = await asyncio.to_thread(self._embed_chunks, chunk_texts, chunk_metadatas)
                 
-                if step_name == "Loading PDF document":
-                    # Load PDF
-                    loader = PyPDFLoader(pdf_path)
-                    documents = loader.load()
-                    
-                elif step_name == "Splitting into chunks":
-                    # Split document into chunks
-                    text_splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=1000, 
-                        chunk_overlap=200,
-                        length_function=len,
-                        is_separator_regex=False,
-                    )
-                    chunks = text_splitter.split_documents(documents)
-                    
-                    if not chunks:
-                        raise Exception("No content found in PDF")
-                    
-                elif step_name == "Processing chunks":
-                    # Get text from chunks
-                    chunk_texts = [chunk.page_content for chunk in chunks]
-                    
-                    # Update progress with chunk info (but don't send extra updates)
-                    if progress_callback and len(chunks) > 0:
-                        detailed_desc = f"📝 Processing {len(chunks)} text chunks from the document..."
-                        # Don't send another progress update here to avoid too many packets
-                    
-                elif step_name == "Generating embeddings":
-                    # Generate embeddings with Hugging Face (this is usually the slowest step)
-                    print(f"🧠 Generating embeddings for {len(chunk_texts)} chunks...")
-                    chunk_embeddings = self.embeddings.embed_documents(chunk_texts)
-                    
-                    # Create IDs for chunks
-                    filename = os.path.basename(pdf_path)
-                    chunk_ids = [f"{filename}-{i}" for i in range(len(chunks))]
-                    
-                elif step_name == "Storing in database":
-                    # Add to ChromaDB
-                    self.collection.add(
-                        ids=chunk_ids,
-                        embeddings=chunk_embeddings,
-                        documents=chunk_texts,
-                        metadatas=[chunk.metadata for chunk in chunks],
-                    )
-                    
-                elif step_name == "Finalizing":
-                    # Calculate processing time
-                    processing_time = time.time() - start_time
-                    filename = os.path.basename(pdf_path)
-                    
-                    if progress_callback:
-                        final_desc = f"🎉 Successfully processed {len(chunks)} chunks from '{filename}' in {processing_time:.1f}s"
-                        await progress_callback(step_name, percentage, final_desc)
-                        
-                    # Add a final small delay to ensure the last update is processed
-                    await asyncio.sleep(0.1)
+                if total == 0:
+                    await report(4)
+                chunk_ids = _chunk_ids(pdf_path, digest, len(chunk_texts), start=total)
+                await asyncio.to_thread(self._add_chunks, chunk_ids, chunk_embeddings, chunk_texts, chunk_metadatas)
+                total += len(chunk_texts)
+            
+            if cache_writer is not None:
+                await asyncio.to_thread(cache_writer.commit)
+                cache_writer = None
+            if total == 0:
+                raise Exception("No content found in PDF")
             
+            processing_time = time.time() - start_time
+            filename = os.path.basename(pdf_path)
+            await report(5, f"🎉 Successfully processed {total} chunks from '{filename}' in {processing_time:.1f}s")
             return True
             
         except Exception as e:
+            if cache_writer is not None:
+                cache_writer.discard()
             if progress_callback:
                 error_desc = f"❌ Processing failed: {str(e)}"
                 await progress_callback("Error", -1, error_desc)
             return False
     
+    def _embed_and_store(self, ids: list, texts: list, metadatas: list, files: list) -> bool:
+        """Embed and store the chunks collected from `files`, reporting progress on the terminal."""
+        steps = self._get_processing_steps()
+        try:
+            step_name, percentage, _ = steps[3]
+            print(f"\n🧠 Generating embeddings for {len(texts)} chunks from {len(files)} file(s)...")
+            print(f"\r{self._create_progress_visual(percentage)} {step_name}", end="", flush=True)
+            embeddings = self._embed_chunks(texts, metadatas)
+            
+            step_name, percentage, _ = steps[4]
+            print(f"\r{self._create_progress_visual(percentage)} {step_name}", end="", flush=True)
+            self._add_chunks(ids, embeddings, texts, metadatas)
+            
+            step_name, percentage, _ = steps[5]
+            print(f"\r{self._create_progress_visual(percentage)} {step_name}")
+            for filename in files:
+                print(f"✅ Successfully processed {filename}")
+            return True
+            
+        except Exception as e:
+            print(f"\n❌ Error embedding or storing chunks: {e}")
+            return False
+    
     def ingest_all_pdfs(self) -> bool:
         """
         Ingest all PDF files in the data directory with progress tracking.
@@ -271,34 +555,46 @@ class DocumentIngestor:
             print(f"  {i}. {filename}")
         print()
         
+        pdf_paths = [os.path.join(DATA_DIR, filename) for filename in pdf_files]
+        
+        # PDF parsing and splitting is CPU bound, so fan it out across cores;
+        # embedding stays in this process so the model is loaded only once.
+        # Workers keep parsing later files while earlier chunks are embedded.
+        print("📖 Loading and splitting PDFs...")
+        workers = max(1, min(len(pdf_paths), (os.cpu_count() or 2) - 1))
+        
+        # Chunks of several files are embedded together in large batches
+        all_ids, all_texts, all_metadatas = [], [], []
+        loaded_files = []
         success_count = 0
         
-        # Use tqdm for file-level progress, and custom progress for each file
-        for file_idx, filename in enumerate(tqdm(pdf_files, desc="Processing PDFs", unit="file")):
-            pdf_path = os.path.join(DATA_DIR, filename)
+        with (multiprocessing.Pool(workers) if workers > 1 else contextlib.nullcontext()) as pool:
+            results = pool.imap(_load_and_split_safe, pdf_paths) if pool else map(_load_and_split_safe, pdf_paths)
             
-            print(f"\n📄 Processing: {filename}")
-            print("-" * 50)
-            
-            try:
-                # Create a simple progress callback for batch processing
-                async def batch_progress_callback(step_name: str, percentage: int, description: str):
-                    progress_visual = self._create_progress_visual(percentage)
-                    print(f"\r{progress_visual} {step_name}", end="", flush=True)
-                    if percentage == 100:
-                        print()  # New line after completion
+            for filename, (result, error) in zip(tqdm(pdf_files, desc="Splitting PDFs", unit="file"), results):
+                if error is not None:
+                    print(f"❌ Error processing file {filename}: {error}")
+                    continue
                 
-                # Use synchronous version for batch processing
-                result = asyncio.run(self.ingest_pdf(pdf_path, batch_progress_callback))
+                chunk_ids, chunk_texts, chunk_metadatas = result
+                if not chunk_texts:
+                    print(f"❌ Failed to process {filename}: No content found in PDF")
+                    continue
                 
-                if result:
-                    success_count += 1
-                    print(f"✅ Successfully processed {filename}")
-                else:
-                    print(f"❌ Failed to process {filename}")
-                    
-            except Exception as e:
-                print(f"❌ Error processing file {filename}: {e}")
+                all_ids.extend(chunk_ids)
+                all_texts.extend(chunk_texts)
+                all_metadatas.extend(chunk_metadatas)
+                loaded_files.append(filename)
+                print(f"📄 {filename}: {len(chunk_texts)} chunks")
+                
+                if len(all_texts) >= BULK_EMBED_BATCH:
+                    if self._embed_and_store(all_ids, all_texts, all_metadatas, loaded_files):
+                        success_count += len(loaded_files)
+                    all_ids, all_texts, all_metadatas = [], [], []
+                    loaded_files = []
+        
+        if all_texts and self._embed_and_store(all_ids, all_texts, all_metadatas, loaded_files):
+            success_count += len(loaded_files)
         
         print(f"\n🎯 Summary: Processed {success_count}/{len(pdf_files)} files successfully.")
         
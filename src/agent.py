@@ -1,9 +1,13 @@
 import os
-from typing import TypedDict, Annotated
+import threading
+from collections import deque
+from typing import TypedDict, Annotated, Optional
+import numpy as np
 from dotenv import load_dotenv
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END, add_messages, START
 from .vector_store import VectorStore
@@ -15,13 +19,23 @@ load_dotenv()
 if "GOOGLE_API_KEY" not in os.environ:
     raise ValueError("GOOGLE_API_KEY not found in environment variables")
 
+# Queries at least this cosine-similar to a recent one reuse its retrieved context
+SEMANTIC_CACHE_THRESHOLD = 0.86
+SEMANTIC_CACHE_SIZE = 128
+
+# Conversation messages sent to the graph per turn, to prevent payload overflow
+MAX_HISTORY_MESSAGES = 10
+
+# Answer returned by RAGAgent.invoke when the graph fails
+FALLBACK_RESPONSE = "I apologize, but I encountered an error processing your request. Please try again."
+
 
 class AgentState(TypedDict):
     """
     Represents the state of the agent.
     """
     messages: Annotated[list[BaseMessage], add_messages]
-    context: list[str]
+    context: str
 
 
 class RAGAgent:
@@ -29,6 +43,11 @@ class RAGAgent:
     A RAG agent that uses LangGraph to orchestrate the workflow.
     """
 
+    # The workflow topology is static, so it is compiled once and shared by all
+    # instances; nodes look up the agent for the current run from its config
+    _GRAPH = None
+    _GRAPH_LOCK = threading.Lock()
+
     def __init__(self, progress_callback=None):
         """
         Initializes the RAGAgent.
@@ -41,6 +60,11 @@ class RAGAgent:
         
         self.vector_store = VectorStore(progress_callback=progress_callback)
         
+        # Recent (query embedding, retrieved context) pairs for paraphrased queries
+        self._semantic_cache = deque(maxlen=SEMANTIC_CACHE_SIZE)
+        self._semantic_cache_generation = self.vector_store.generation
+        self._semantic_cache_lock = threading.Lock()
+        
         if progress_callback:
             progress_callback(80, "llm_init", "🧠 Initializing language model...")
         
@@ -55,27 +79,41 @@ class RAGAgent:
         if progress_callback:
             progress_callback(90, "graph_build", "🔗 Building workflow graph...")
         
-        self.graph = self._build_graph()
+        with RAGAgent._GRAPH_LOCK:
+            if RAGAgent._GRAPH is None:
+                RAGAgent._GRAPH = RAGAgent._build_graph()
+        self.graph = RAGAgent._GRAPH.with_config(configurable={"agent": self})
         
         if progress_callback:
             progress_callback(100, "agent_ready", "✅ RAG Agent ready!")
 
-    def _build_graph(self) -> StateGraph:
+    @staticmethod
+    def _bound(method_name: str):
+        """
+        Returns a graph callable that runs the named method on the agent in the run config.
+        """
+        def call(state: AgentState, config: RunnableConfig):
+            return getattr(config["configurable"]["agent"], method_name)(state)
+        call.__name__ = method_name
+        return call
+
+    @staticmethod
+    def _build_graph() -> StateGraph:
         """
         Builds the LangGraph for the agent.
         """
         workflow = StateGraph(AgentState)
 
         # Add nodes
-        workflow.add_node("retrieve", self._retrieve)
-        workflow.add_node("generate", self._generate)
-        workflow.add_node("rewrite", self._rewrite)
+        workflow.add_node("retrieve", RAGAgent._bound("_retrieve"))
+        workflow.add_node("generate", RAGAgent._bound("_generate"))
+        workflow.add_node("rewrite", RAGAgent._bound("_rewrite"))
 
         # Add edges
         workflow.add_edge(START, "retrieve")
         workflow.add_conditional_edges(
             "retrieve",
-            self._decide_to_generate,
+            RAGAgent._bound("_decide_to_generate"),
             {
                 "generate": "generate",
                 "rewrite": "rewrite",
@@ -92,9 +130,37 @@ class RAGAgent:
         """
         print("---RETRIEVING DOCUMENTS---")
         last_message = state["messages"][-1]
-        retrieved_docs = self.vector_store.search(last_message.content)
+        query_vector = self.vector_store.embed_query(last_message.content)
+        # Not in place: the embedding is shared with the vector store's query cache
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        
+        retrieved_docs = self._cached_context(query_vector)
+        if retrieved_docs is None:
+            retrieved_docs = self.vector_store.search_joined(last_message.content)
+            if retrieved_docs:
+                with self._semantic_cache_lock:
+                    self._semantic_cache.append((query_vector, retrieved_docs))
         return {"context": retrieved_docs}
 
+    def _cached_context(self, query_vector: np.ndarray) -> Optional[str]:
+        """
+        Returns the context retrieved for a recent, near-identical query, if any.
+        """
+        with self._semantic_cache_lock:
+            # Newly ingested documents invalidate every cached result
+            if self._semantic_cache_generation != self.vector_store.generation:
+                self._semantic_cache.clear()
+                self._semantic_cache_generation = self.vector_store.generation
+            if not self._semantic_cache:
+                return None
+            
+            similarities = np.stack([vector for vector, _ in self._semantic_cache]) @ query_vector
+            best = int(similarities.argmax())
+            if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+                print("---SEMANTIC CACHE HIT---")
+                return self._semantic_cache[best][1]
+            return None
+
     def _generate(self, state: AgentState) -> AgentState:
         """
         Generates a response using the retrieved context and conversation history.
@@ -110,7 +176,7 @@ class RAGAgent:
         ])
         chain = prompt | self.llm | StrOutputParser()
         response = chain.invoke(
-            {"context": "\n".join(state["context"]), "question": state["messages"][-1].content}
+            {"context": state["context"], "question": state["messages"][-1].content}
         )
         return {"messages": [AIMessage(content=response)]}
 
@@ -135,28 +201,34 @@ class RAGAgent:
         Decides whether to generate a response or to rewrite the query.
         """
         print("---DECIDING TO GENERATE---")
-        if len(state["context"]) == 0:
+        if not state["context"]:
             print("---DECISION: REWRITE---")
             return "rewrite"
         else:
             print("---DECISION: GENERATE---")
             return "generate"
 
-    def invoke(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+    @staticmethod
+    def trim_history(messages: list[BaseMessage]) -> list[BaseMessage]:
         """
-        Invokes the agent with a list of messages.
+        Limits a conversation to the messages sent to the graph.
         """
-        # Limit the number of messages to prevent payload overflow
         # Keep only the last few messages to maintain context while preventing overflow
-        max_messages = 10
-        if len(messages) > max_messages:
+        if len(messages) > MAX_HISTORY_MESSAGES:
             # Keep the first message (usually system) and the last few messages
-            messages = messages[:1] + messages[-(max_messages-1):]
+            messages = messages[:1] + messages[-(MAX_HISTORY_MESSAGES-1):]
+        return messages
+
+    def invoke(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        Invokes the agent with a list of messages.
+        """
+        messages = self.trim_history(messages)
         
         try:
-            result = self.graph.invoke({"messages": messages, "context": []})
+            result = self.graph.invoke({"messages": messages, "context": ""})
             return result["messages"]
         except Exception as e:
             print(f"Error in agent invoke: {e}")
             # Return a safe fallback response
-            return messages + [AIMessage(content="I apologize, but I encountered an error processing your request. Please try again.")]
+            return messages + [AIMessage(content=FALLBACK_RESPONSE)]
@@ -1,62 +1,253 @@
 import chromadb
 from langchain_huggingface import HuggingFaceEmbeddings
+import contextlib
+import functools
+import hashlib
+import logging
+import numpy as np
 import os
-import sys
-from tqdm import tqdm
-import time
+import sqlite3
+import threading
 
 
 # Constants
 CHROMA_DB_PATH = "chroma_db"
 CHROMA_COLLECTION_NAME = "rag_collection"
 DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# sentence-transformers inference backend: "torch", "onnx" or "openvino"
+DEFAULT_EMBEDDING_BACKEND = "torch"
+# Int8 quantization target used when EMBEDDING_QUANTIZED=1: "avx512_vnni", "avx512", "avx2" or "arm64"
+DEFAULT_QUANTIZATION = "avx512_vnni"
+# Locally quantized ONNX copies of embedding models
+QUANTIZED_MODEL_DIR = os.path.expanduser("~/.cache/onnx-embeddings")
+# Embedding device: "auto" (default) picks CUDA, then Apple MPS, then CPU; or pin e.g. "cpu"
+DEFAULT_EMBED_DEVICE = "auto"
+# Number of distinct query embeddings kept per VectorStore
+QUERY_CACHE_SIZE = 1024
+# Query embeddings persisted across restarts, bounded to ~100 MB of 384-d float32 vectors.
+# Kept outside CHROMA_DB_PATH: they only depend on the model, not on the stored documents
+QUERY_DISK_CACHE_DIR = ".query_cache"
+QUERY_DISK_CACHE_PATH = os.path.join(QUERY_DISK_CACHE_DIR, "query_embeddings.sqlite")
+QUERY_DISK_CACHE_ROWS = 65536
+# Opt-in two-stage search: Hamming distance over 1-bit codes, then exact re-ranking
+BINARY_SEARCH = os.getenv("VECTOR_SEARCH_BINARY", "").lower() in ("1", "true", "yes")
+# Candidates fetched per requested result before re-ranking
+BINARY_OVERSAMPLE = 10
+# Embeddings read per page when building the binary index
+BINARY_INDEX_PAGE = 1000
+# Set bits per byte value, for Hamming distances over packed codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# Character budget for the context passed to the LLM
+MAX_CONTEXT_CHARS = 12000
+# HNSW index settings; Chroma only applies these when the collection is first created.
+# CHROMA_HNSW_M / CHROMA_HNSW_CONSTRUCTION_EF / CHROMA_HNSW_SEARCH_EF override them for tuning
+HNSW_SEARCH_EF = int(os.getenv("CHROMA_HNSW_SEARCH_EF", "100"))
+# Chroma's search_ef for collections created without one in their metadata
+CHROMA_DEFAULT_SEARCH_EF = 10
+CHROMA_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "200")),
+    "hnsw:search_ef": HNSW_SEARCH_EF,
+    "hnsw:M": int(os.getenv("CHROMA_HNSW_M", "16")),
+    "hnsw:num_threads": os.cpu_count() or 1,
+}
+
+# Inter-op threads for torch; the MiniLM forward pass is intra-op (matmul) bound
+TORCH_INTEROP_THREADS = 2
+# Intra-op threads for embedding inference: EMBEDDING_THREADS, else OMP_NUM_THREADS, else the CPU count
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS") or os.getenv("OMP_NUM_THREADS") or os.cpu_count() or 1)
+
+# Size the BLAS/OpenMP pools as well. torch is only imported when a model is loaded,
+# so setting these at import time takes effect (unless the caller set them already)
+os.environ.setdefault("OMP_NUM_THREADS", str(EMBEDDING_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(EMBEDDING_THREADS))
+
+logger = logging.getLogger(__name__)
+
+# Loaded embedding models, shared by every VectorStore and DocumentIngestor in the process
+_MODEL_CACHE: dict[tuple, HuggingFaceEmbeddings] = {}
+_MODEL_LOCK = threading.Lock()
+
+
+def _embedding_config(model_name: str = None) -> tuple:
+    """
+    Resolve the embedding configuration from the environment.
+
+    Returns:
+        (model name, backend, ONNX file, device, quantization target)
+    """
+    if model_name is None:
+        model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    backend = os.getenv("EMBEDDING_BACKEND", DEFAULT_EMBEDDING_BACKEND).lower()
+    onnx_file = os.getenv("EMBEDDING_ONNX_FILE")
+    device = os.getenv("EMBED_DEVICE", DEFAULT_EMBED_DEVICE).lower()
+    quantization = os.getenv("EMBEDDING_QUANTIZED", "").lower()
+    if quantization in ("", "0", "false", "no"):
+        quantization = None
+    elif quantization in ("1", "true", "yes"):
+        quantization = DEFAULT_QUANTIZATION
+    return model_name, backend, onnx_file, device, quantization
 
 
 def create_embeddings_with_progress(model_name: str = None, progress_callback=None):
     """
-    Create HuggingFace embeddings with download progress tracking.
+    Get HuggingFace embeddings, loading the model on first use with download progress tracking.
+    
+    Models are cached per process, so later calls with the same configuration reuse
+    the loaded model instead of reading it from disk again.
     
     Args:
         model_name: Name of the embedding model
         progress_callback: Callback function to report progress
     """
-    if model_name is None:
-        model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    cache_key = _embedding_config(model_name)
+    model_name, backend, onnx_file, device, quantization = cache_key
+    # Loaded models are returned without taking the lock, so callers of a loaded
+    # model never wait behind another model's (possibly slow, downloading) load
+    embeddings = _MODEL_CACHE.get(cache_key)
+    if embeddings is None:
+        # Held while loading, so concurrent callers wait for one load instead of duplicating it
+        with _MODEL_LOCK:
+            embeddings = _MODEL_CACHE.get(cache_key)
+            if embeddings is None:
+                embeddings = _load_embeddings(model_name, backend, onnx_file, device, progress_callback,
+                                              quantization=quantization)
+                _MODEL_CACHE[cache_key] = embeddings
+                return embeddings
+    if progress_callback:
+        progress_callback(100, "cached", "📂 Using loaded embedding model")
+    return embeddings
+
+
+def _detect_device() -> str:
+    """
+    Return the fastest available torch device for the embedding model.
+    """
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except Exception:
+        pass
+    return "cpu"
+
+
+def _is_model_cached(model_name: str) -> bool:
+    """
+    Check whether a model is available locally, without scanning the cache directory.
+    """
+    if os.path.isdir(model_name):
+        return True
+    from huggingface_hub import try_to_load_from_cache
+    # A str is a cached file path; None or a sentinel means it would be downloaded
+    return isinstance(try_to_load_from_cache(model_name, "config.json"), str)
+
+
+def _configure_torch_threads(torch):
+    """
+    Size torch's CPU thread pools for embedding inference.
     
-    # Check if model is already cached
-    from transformers import AutoModel
+    Intra-op threads follow EMBEDDING_THREADS (see the module constant). The
+    inter-op pool can only be sized before torch runs parallel work, so a late
+    call keeps torch's default.
+    """
+    torch.set_num_threads(EMBEDDING_THREADS)
+    try:
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError:
+        pass
+
+
+def _quantized_model(model_name: str, quantization: str) -> tuple[str, str]:
+    """
+    Return (model directory, ONNX file) for an int8-quantized copy of a model,
+    exporting and quantizing it into QUANTIZED_MODEL_DIR on first use.
+    """
+    model_dir = os.path.join(QUANTIZED_MODEL_DIR, model_name.replace("/", "--"))
+    onnx_file = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(model_dir, onnx_file)):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(model_dir)
+        export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    return model_dir, onnx_file
+
+
+def _load_embeddings(model_name: str, backend: str, onnx_file: str = None, device: str = DEFAULT_EMBED_DEVICE,
+                     progress_callback=None, quantization: str = None):
+    """
+    Load HuggingFace embeddings with download progress tracking.
+    
+    Args:
+        model_name: Name of the embedding model
+        backend: sentence-transformers inference backend
+        onnx_file: Optional ONNX export to load for non-torch backends
+        device: Torch device name, or "auto" to detect one
+        progress_callback: Callback function to report progress
+        quantization: Int8 quantization target; serves a quantized ONNX copy on CPU
+    """
+    # Imported here so importing this module stays cheap until a model is needed
     import torch
     
+    _configure_torch_threads(torch)
+    
     try:
-        # Try to load model to see if it's cached
-        model_cache_dir = os.path.expanduser("~/.cache/huggingface/transformers")
-        model_cached = False
-        
-        if os.path.exists(model_cache_dir):
-            # Simple check - if any files exist for this model
-            cached_files = [f for f in os.listdir(model_cache_dir) if model_name.replace("/", "--") in f]
-            model_cached = len(cached_files) > 0
+        model_cached = _is_model_cached(model_name)
         
         if progress_callback and not model_cached:
             progress_callback(0, "download", "🔄 Downloading embedding model...")
             progress_callback(25, "download", f"📥 Fetching {model_name}...")
         
-        # Create embeddings with progress simulation
+        # Dynamic int8 quantization runs through ONNX Runtime's CPU kernels (VNNI where available)
+        if quantization and not onnx_file:
+            if progress_callback:
+                progress_callback(50, "download", "🗜️ Preparing int8-quantized model...")
+            model_name, onnx_file = _quantized_model(model_name, quantization)
+            backend, device = "onnx", "cpu"
+        
+        if device == "auto":
+            device = _detect_device()
+            if backend != "torch" and device == "mps":
+                device = "cpu"  # ONNX Runtime / OpenVINO have no MPS support
+        
+        model_kwargs = {
+            'device': device,
+            'trust_remote_code': False,
+        }
+        loader_kwargs = {}
+        
+        # Optional ONNX Runtime / OpenVINO backend; EMBEDDING_ONNX_FILE selects a
+        # specific export, e.g. "onnx/model_qint8_avx512_vnni.onnx" for int8 VNNI kernels
+        if backend != "torch":
+            model_kwargs['backend'] = backend
+            if onnx_file:
+                loader_kwargs['file_name'] = onnx_file
+            if backend == "onnx":
+                # Pin the execution provider to the selected device rather than
+                # whichever providers the installed onnxruntime build lists first
+                loader_kwargs['provider'] = (
+                    "CUDAExecutionProvider" if device.startswith("cuda") else "CPUExecutionProvider"
+                )
+        elif device.startswith("cuda"):
+            # Half precision on GPU; normalized MiniLM embeddings lose no meaningful recall
+            loader_kwargs['torch_dtype'] = torch.float16
+        if loader_kwargs:
+            model_kwargs['model_kwargs'] = loader_kwargs
+        
+        # Create embeddings
         embeddings = HuggingFaceEmbeddings(
             model_name=model_name,
-            model_kwargs={
-                'device': 'cpu',  # Use CPU for consistency
-                'trust_remote_code': False,
-            },
+            model_kwargs=model_kwargs,
             encode_kwargs={
                 'normalize_embeddings': True,  # Must match ingest.py settings
-                'batch_size': 32,
+                'batch_size': 128 if device.startswith("cuda") else 64,
             }
         )
         
         if progress_callback and not model_cached:
             progress_callback(75, "download", "🔧 Initializing model...")
-            time.sleep(0.5)  # Small delay for visual feedback
             progress_callback(100, "download", "✅ Embedding model ready!")
         elif progress_callback:
             progress_callback(100, "cached", "📂 Using cached embedding model")
@@ -69,6 +260,142 @@ def create_embeddings_with_progress(model_name: str = None, progress_callback=No
         raise
 
 
+class QueryDiskCache:
+    """
+    SQLite-backed store of query embeddings, so a restarted process starts with a warm cache.
+
+    Keys hash the embedding configuration together with the query, so switching models
+    never serves stale vectors. A connection is opened per operation, so no file handle
+    outlives a call. The cache is only an optimization: any SQLite error disables or
+    skips it instead of failing the query.
+    """
+
+    def __init__(self, path: str, namespace: str, max_rows: int = QUERY_DISK_CACHE_ROWS):
+        self._path = path
+        self._namespace = namespace.encode("utf-8") + b"\0"
+        self._max_rows = max_rows
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._enabled = True
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings (key BLOB PRIMARY KEY, embedding BLOB NOT NULL)"
+                )
+        except (OSError, sqlite3.Error):
+            self._enabled = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Yield a connection inside a transaction, closing it afterwards.
+        """
+        conn = sqlite3.connect(self._path)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _key(self, query: str) -> bytes:
+        return hashlib.blake2b(self._namespace + query.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, query: str):
+        """
+        Return the stored embedding for a query as a read-only float32 array, or None.
+        """
+        if not self._enabled:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT embedding FROM query_embeddings WHERE key = ?", (self._key(query),)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def put(self, query: str, embedding: np.ndarray):
+        """
+        Store a query embedding, evicting the oldest entries once the cache is full.
+        """
+        if not self._enabled:
+            return
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding) VALUES (?, ?)",
+                    (self._key(query), embedding.astype(np.float32).tobytes()),
+                )
+                self._writes += 1
+                # Rowids grow with each insert, so low rowids are the least recently stored
+                if self._writes % 1024 == 0:
+                    conn.execute(
+                        "DELETE FROM query_embeddings WHERE rowid <= (SELECT MAX(rowid) FROM query_embeddings) - ?",
+                        (self._max_rows,),
+                    )
+        except sqlite3.Error:
+            pass
+
+
+class BinaryIndex:
+    """
+    In-memory 1-bit codes (the sign of each dimension) of every stored embedding.
+
+    A 384-d embedding packs into 48 bytes, so candidates for a query can be found by
+    Hamming distance over the whole collection while touching ~32x less memory than
+    the float32 vectors; the candidates are then re-ranked exactly.
+
+    Building the index reads every stored embedding from the collection (one page of
+    BINARY_INDEX_PAGE vectors at a time) and keeps only the codes and ids in memory.
+    VectorStore builds it on the first binary search and again after each refresh.
+    """
+
+    def __init__(self, collection):
+        self.ids = []
+        codes = []
+        for offset in range(0, collection.count(), BINARY_INDEX_PAGE):
+            page = collection.get(include=["embeddings"], limit=BINARY_INDEX_PAGE, offset=offset)
+            if len(page["ids"]):
+                self.ids.extend(page["ids"])
+                codes.append(np.packbits(np.asarray(page["embeddings"]) > 0, axis=1))
+        self.codes = np.concatenate(codes) if codes else np.empty((0, 0), dtype=np.uint8)
+
+    def candidates(self, query_embedding: np.ndarray, count: int) -> list[str]:
+        """
+        Return the ids of the `count` stored embeddings nearest to the query in Hamming distance.
+        """
+        if not self.ids:
+            return []
+        query_code = np.packbits(query_embedding > 0)
+        distances = _POPCOUNT[self.codes ^ query_code].sum(axis=1, dtype=np.uint32)
+        count = min(count, len(self.ids))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        return [self.ids[i] for i in nearest]
+
+
+def open_collection(client):
+    """
+    Open (or create) the document collection with the shared HNSW settings.
+    """
+    return client.get_or_create_collection(
+        name=CHROMA_COLLECTION_NAME, metadata=CHROMA_COLLECTION_METADATA,
+        embedding_function=None,  # Embeddings always come from our own (cached) model
+    )
+
+
+def rerank(embeddings, query_embedding: np.ndarray, n_results: int) -> np.ndarray:
+    """
+    Return the positions of the `n_results` embeddings most similar to the query, best first.
+    """
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    scores = np.asarray(embeddings, dtype=np.float32) @ query_embedding
+    return np.argsort(-scores)[:n_results]
+
+
 class VectorStore:
     """
     A class to interact with a ChromaDB vector store using Hugging Face embeddings.
@@ -82,11 +409,54 @@ class VectorStore:
             progress_callback: Optional callback for tracking embedding model download
         """
         self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        self.collection = self.client.get_or_create_collection(name=CHROMA_COLLECTION_NAME)
+        self.collection = open_collection(self.client)
+        # Bumped on refresh, so callers caching search results can tell when they are stale
+        self.generation = 0
+        
+        # Built on first use when BINARY_SEARCH is enabled, and rebuilt after a refresh
+        self._binary_index = None
+        self._binary_index_generation = None
+        self._binary_index_lock = threading.Lock()
         
         # Initialize Hugging Face embeddings with progress tracking
         model_name = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
         self.embeddings = create_embeddings_with_progress(model_name, progress_callback)
+        self._query_disk_cache = QueryDiskCache(QUERY_DISK_CACHE_PATH, repr(_embedding_config(model_name)))
+        
+        # Repeated queries (e.g. rewrite -> retrieve loops) skip the model entirely;
+        # hit/miss counts are available from self._embed_query.cache_info()
+        self._embed_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._compute_query_embedding)
+
+    def _compute_query_embedding(self, query: str) -> np.ndarray:
+        """
+        Embeds a query; results are cached by the LRU wrapper set up in __init__.
+
+        Cached as read-only float32 arrays (~1.5 KB each for MiniLM, versus ~10 KB
+        as a tuple of Python floats), so cache hits can be shared safely. Misses
+        check the on-disk cache before running the model.
+        """
+        embedding = self._query_disk_cache.get(query)
+        if embedding is None:
+            embedding = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            embedding.flags.writeable = False
+            self._query_disk_cache.put(query, embedding)
+        return embedding
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Embeds a query, reusing the cached embedding for repeated queries.
+
+        The returned array is shared with the cache and read-only.
+        """
+        return self._embed_query(query)
+
+    def refresh(self):
+        """
+        Re-opens the collection so documents ingested elsewhere are visible,
+        without reloading the embedding model.
+        """
+        self.collection = open_collection(self.client)
+        self.generation += 1
 
     def search(self, query: str, n_results: int = 5) -> list[str]:
         """
@@ -99,9 +469,112 @@ class VectorStore:
         Returns:
             A list of the most similar documents.
         """
-        query_embedding = self.embeddings.embed_query(query)
+        return self._query_documents(query, n_results)
+
+    def _check_n_results(self, n_results: int):
+        """
+        Validate a result count before any embedding work is done.
+
+        Counts above the collection's HNSW search_ef are allowed, since HNSW widens
+        its search to cover them, but logged: the extra tail matches are lower quality.
+        The limit is read from the collection, whose settings were fixed at creation.
+        """
+        if n_results < 1:
+            raise ValueError(f"n_results must be at least 1, got {n_results}")
+        search_ef = (self.collection.metadata or {}).get("hnsw:search_ef", CHROMA_DEFAULT_SEARCH_EF)
+        if n_results > search_ef:
+            logger.warning(
+                "n_results=%d exceeds the collection's HNSW search_ef (%d); tail results may be less accurate",
+                n_results, search_ef,
+            )
+
+    def _query_documents(self, query: str, n_results: int) -> list[str]:
+        """
+        Returns the documents nearest to a query, using the binary index when enabled.
+        """
+        self._check_n_results(n_results)
+        query_embedding = self.embed_query(query)
+        if BINARY_SEARCH:
+            return self._binary_search(query_embedding, n_results)
+        
         results = self.collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=query_embedding.reshape(1, -1),  # 2-D float32, no per-element boxing
             n_results=n_results,
+            include=["documents"],
         )
         return results["documents"][0] if results["documents"] else []
+
+    def _binary_search(self, query_embedding: np.ndarray, n_results: int) -> list[str]:
+        """
+        Over-fetches candidates by Hamming distance, then re-ranks them by exact similarity.
+        """
+        with self._binary_index_lock:
+            if self._binary_index is None or self._binary_index_generation != self.generation:
+                self._binary_index = BinaryIndex(self.collection)
+                self._binary_index_generation = self.generation
+            index = self._binary_index
+        
+        candidate_ids = index.candidates(query_embedding, n_results * BINARY_OVERSAMPLE)
+        if not candidate_ids:
+            return []
+        candidates = self.collection.get(ids=candidate_ids, include=["embeddings", "documents"])
+        return [candidates["documents"][i] for i in rerank(candidates["embeddings"], query_embedding, n_results)]
+
+    def search_batch(self, queries: list[str], n_results: int = 5) -> list[list[str]]:
+        """
+        Searches the vector store for several queries at once.
+
+        All queries are embedded in one batched forward pass (sentence-transformers
+        already orders them by length to minimize padding) and looked up with one
+        Chroma query.
+
+        Args:
+            queries: The queries to search for.
+            n_results: The number of results to return per query.
+
+        Returns:
+            One list of the most similar documents per query, in query order.
+        """
+        if not queries:
+            return []
+        self._check_n_results(n_results)
+        query_embeddings = np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+        if BINARY_SEARCH:
+            return [self._binary_search(query_embedding, n_results) for query_embedding in query_embeddings]
+        
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents"],
+        )
+        return results["documents"] or [[] for _ in queries]
+
+    def search_joined(self, query: str, n_results: int = 5, sep: str = "\n",
+                      max_chars: int = MAX_CONTEXT_CHARS) -> str:
+        """
+        Searches the vector store and returns the matching documents as one context string.
+
+        Args:
+            query: The query to search for.
+            n_results: The number of documents to retrieve.
+            sep: Separator placed between documents.
+            max_chars: Maximum length of the returned string; documents past the budget are cut.
+
+        Returns:
+            The joined documents, or an empty string if nothing matched.
+        """
+        documents = self._query_documents(query, n_results)
+        
+        parts = []
+        remaining = max_chars
+        for document in documents:
+            if parts:
+                if remaining <= len(sep):
+                    break
+                parts.append(sep)
+                remaining -= len(sep)
+            parts.append(document[:remaining])
+            remaining -= len(parts[-1])
+            if remaining <= 0:
+                break
+        return "".join(parts)
@@ -0,0 +1,124 @@
+"""
+Tests for the binary-quantized search path (VECTOR_SEARCH_BINARY).
+
+Uses an in-memory stand-in for the Chroma collection, so no model or database is needed.
+"""
+import threading
+import numpy as np
+from src.vector_store import BinaryIndex, VectorStore, rerank
+
+DIMENSIONS = 384
+
+
+class FakeCollection:
+    """The subset of the Chroma collection API that BinaryIndex and _binary_search use."""
+
+    def __init__(self, embeddings: np.ndarray):
+        self.ids = []
+        self.embeddings = {}
+        self.add(embeddings)
+
+    def add(self, embeddings: np.ndarray):
+        for embedding in embeddings:
+            doc_id = f"doc-{len(self.ids)}"
+            self.ids.append(doc_id)
+            self.embeddings[doc_id] = embedding
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def get(self, ids=None, include=None, limit=None, offset=0):
+        if ids is None:
+            ids = self.ids[offset:offset + limit]
+        return {
+            "ids": ids,
+            "embeddings": np.array([self.embeddings[doc_id] for doc_id in ids]),
+            "documents": list(ids),
+        }
+
+
+class FakeClient:
+    def __init__(self, collection: FakeCollection):
+        self.collection = collection
+
+    def get_or_create_collection(self, **kwargs):
+        return self.collection
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def make_store(collection: FakeCollection) -> VectorStore:
+    """A VectorStore wired to the fake collection, without loading an embedding model."""
+    store = VectorStore.__new__(VectorStore)
+    store.client = FakeClient(collection)
+    store.collection = collection
+    store.generation = 0
+    store._binary_index = None
+    store._binary_index_generation = None
+    store._binary_index_lock = threading.Lock()
+    return store
+
+
+def test_candidates_are_hamming_nearest():
+    """candidates() returns exactly the codes closest to the query in Hamming distance."""
+    rng = np.random.default_rng(0)
+    embeddings = normalized(rng.standard_normal((2500, DIMENSIONS)))
+    index = BinaryIndex(FakeCollection(embeddings))
+    assert len(index.ids) == 2500
+    
+    query = embeddings[42]
+    distances = ((embeddings > 0) != (query > 0)).sum(axis=1)
+    candidates = index.candidates(query, 10)
+    worst_candidate = max(distances[int(doc_id.split("-")[1])] for doc_id in candidates)
+    assert len(candidates) == 10
+    assert "doc-42" in candidates
+    assert worst_candidate <= np.sort(distances)[9]
+    print("✅ Hamming top-k matches a brute-force count")
+
+
+def test_rerank_orders_by_exact_similarity():
+    """rerank() orders candidates by cosine similarity, best first."""
+    rng = np.random.default_rng(1)
+    embeddings = normalized(rng.standard_normal((50, DIMENSIONS)))
+    query = embeddings[7]
+    expected = np.argsort(-(embeddings @ query))[:5]
+    assert list(rerank(embeddings, query, 5)) == list(expected)
+    assert rerank(embeddings, query, 5)[0] == 7
+    print("✅ Re-ranking matches exact cosine order")
+
+
+def test_binary_search_finds_exact_match():
+    """A stored vector is its own best match after Hamming filtering and re-ranking."""
+    rng = np.random.default_rng(2)
+    embeddings = normalized(rng.standard_normal((1000, DIMENSIONS)))
+    store = make_store(FakeCollection(embeddings))
+    assert store._binary_search(embeddings[123], 3)[0] == "doc-123"
+    print("✅ Binary search returns the exact match first")
+
+
+def test_refresh_rebuilds_index():
+    """Documents added after the index was built are searchable once the store is refreshed."""
+    rng = np.random.default_rng(3)
+    collection = FakeCollection(normalized(rng.standard_normal((100, DIMENSIONS))))
+    store = make_store(collection)
+    new_embedding = normalized(rng.standard_normal((1, DIMENSIONS)))
+    
+    store._binary_search(new_embedding[0], 1)
+    first_index = store._binary_index
+    collection.add(new_embedding)
+    assert store._binary_search(new_embedding[0], 1) != ["doc-100"]
+    
+    store.refresh()
+    assert store._binary_search(new_embedding[0], 1) == ["doc-100"]
+    assert store._binary_index is not first_index
+    print("✅ Refresh rebuilds the binary index")
+
+
+if __name__ == "__main__":
+    test_candidates_are_hamming_nearest()
+    test_rerank_orders_by_exact_similarity()
+    test_binary_search_finds_exact_match()
+    test_refresh_rebuilds_index()
+    print("\n🎉 All binary index tests passed!")
@@ -7,9 +7,35 @@ import os
 import json
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from app import save_chat_history, load_chat_history, get_recent_chats, generate_chat_title
 
+try:
+    import orjson  # Optional: much faster JSON decode
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+REQUIRED_FIELDS = ['id', 'title', 'created_at', 'updated_at', 'message_count']
+
+
+def validate_chat_file(chat_dir, filename):
+    """Check a metadata header and its message log; returns an error message, or None if valid."""
+    try:
+        with open(os.path.join(chat_dir, filename), 'rb') as f:
+            data = loads(f.read())
+        log_path = os.path.join(chat_dir, filename[:-len('.meta.json')] + '.jsonl')
+        with open(log_path, 'rb') as f:
+            messages = [loads(line) for line in f.read().splitlines() if line.strip()]
+        if not all(field in data for field in REQUIRED_FIELDS):
+            return "missing required fields"
+        if len(messages) != data['message_count']:
+            return f"expected {data['message_count']} messages, found {len(messages)}"
+        return None
+    except Exception as e:
+        return str(e)
+
 def test_chat_history():
     """Test chat history functions."""
     
@@ -117,20 +143,18 @@ def test_chat_history():
         # Test 4: File structure validation
         print("\n4. Testing file structure...")
         
-        chat_files = [f for f in os.listdir(test_dir) if f.endswith('.json')]
+        chat_files = [f for f in os.listdir(test_dir) if f.endswith('.meta.json')]
         print(f"   📁 Chat files created: {len(chat_files)}")
         
-        # Validate JSON structure
+        # Validate metadata headers and their message logs, overlapping the file reads
         valid_files = 0
-        for filename in chat_files:
-            try:
-                with open(os.path.join(test_dir, filename), 'r') as f:
-                    data = json.load(f)
-                    required_fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
-                    if all(field in data for field in required_fields):
-                        valid_files += 1
-            except Exception as e:
-                print(f"   ❌ Invalid file {filename}: {e}")
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            errors = list(executor.map(lambda filename: validate_chat_file(test_dir, filename), chat_files))
+        for filename, error in zip(chat_files, errors):
+            if error is None:
+                valid_files += 1
+            else:
+                print(f"   ❌ Invalid file {filename}: {error}")
         
         print(f"   ✅ Valid chat files: {valid_files}/{len(chat_files)}")
         
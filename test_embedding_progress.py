@@ -9,6 +9,15 @@ import time
 from src.vector_store import create_embeddings_with_progress
 from ingest import DocumentIngestor
 
+# FAST_TEST=1 (e.g. in CI) skips the cosmetic delays of the UI simulation
+FAST_TEST = bool(os.getenv("FAST_TEST"))
+
+
+def pause(seconds):
+    """Sleep for visual effect, unless running with FAST_TEST."""
+    if not FAST_TEST:
+        time.sleep(seconds)
+
 def test_embedding_progress():
     """Test embedding model download progress tracking."""
     
@@ -113,7 +122,7 @@ def simulate_ui_progress():
         
         # Clear line and show progress
         print(f"\r   {progress_bar} {percentage:3d}% {step_indicator} {description}", end="", flush=True)
-        time.sleep(0.1)  # Small delay for visual effect
+        pause(0.1)  # Small delay for visual effect
     
     print("\nSimulating embedding model download progress:")
     
@@ -128,7 +137,7 @@ def simulate_ui_progress():
     
     for percentage, stage, description in stages:
         ui_progress(percentage, stage, description)
-        time.sleep(0.5)
+        pause(0.5)
     
     print("\n\n✨ Progress visualization complete!")
 